@@ -9,7 +9,7 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from functools import lru_cache
 from pathlib import Path
-from typing import Union, List, Dict, Optional, Callable, Type
+from typing import Union, List, Dict, Optional, Callable, Type, Tuple
 
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -28,10 +28,97 @@ logger = logging.getLogger(__name__)
 
 SPECIALIZED_ASSISTANT = {}
 ADDITIONAL_TOKENS_PER_MSG = 3
+MAX_CACHED_TEXT_LEN = 2048
+"""Number of tokens is cached only for texts up to this length, not to keep the long texts in memory"""
+MIN_ENCODE_BATCH = 4
+"""Minimal number of long texts to encode them in parallel threads"""
 
 DummyBaseMessage = namedtuple("Dummy", "content response_metadata")
 
 
+@lru_cache(maxsize=32)
+def _get_encoding(model: str) -> Encoding:
+    """
+    Get the tiktoken encoding of the model, once per model.
+
+    :param model: LLM model name
+    :return: model encoding or cl100k_base for unknown model
+    """
+    try:
+        return encoding_for_model(model)
+    except KeyError:
+        return get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4096)
+def _encoded_len(model: str, text: str) -> int:
+    """
+    Calculate number of tokens from text, shared by all assistants using the same model.
+
+    :param model: LLM model name
+    :param text: text to encode
+    :return: number of tokens
+    """
+    return len(_get_encoding(model).encode(text))
+
+
+def _split_message(msg: str, image_data: bool) -> Tuple[Tuple[str, str], ...]:
+    """
+    Split a message into text and image segments.
+
+    :param msg: The input message string containing text and image markdown.
+    :param image_data: Add image data URL, otherwise the image is replaced by the text
+    :return: Tuple of (type, text or image data URL) segments
+    """
+    segments = []
+    start_idx = 0
+    for m in IMAGE_DATA_URL_MARKDOWN_RE.finditer(msg):
+        img_start = m.start(0)
+        if img_start > 0:
+            segments.append(("text", msg[start_idx:img_start]))
+        start_idx = m.end(0)
+        if image_data:
+            segments.append(("image_url", m.group("img_data")))
+        else:
+            segments.append(("text", "generated image cannot be put here because of size"))
+    if msg[start_idx:]:
+        segments.append(("text", msg[start_idx:]))
+    return tuple(segments)
+
+
+_split_message_cached = lru_cache(maxsize=256)(_split_message)
+"""`_split_message` for short messages without images, which are scanned once"""
+
+
+@lru_cache(maxsize=64)
+def _assistant_template(prompt: str, with_tools: bool) -> ChatPromptTemplate:
+    """
+    Create the assistant prompt template, once per system prompt.
+
+    The user query is passed in `query` placeholder, as it is different in every call.
+
+    :param prompt: assistant system prompt
+    :param with_tools: template for assistant with tools, with agent scratchpad
+    :return: prompt template, shared by all calls, do not modify it
+    """
+    if with_tools:
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", prompt),
+                MessagesPlaceholder("chat_history", optional=True),
+                MessagesPlaceholder("query"),
+                MessagesPlaceholder("agent_scratchpad"),
+            ]
+        )
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", prompt),
+            MessagesPlaceholder("hist", optional=True),
+            MessagesPlaceholder("query"),
+        ]
+    )
+
+
 class AssistantType(enum.Enum):
     """Assistant type."""
 
@@ -89,6 +176,8 @@ class BaseAssistant:
     """Force LLM to output in json_object format"""
     pydantic_output: Type[BaseModel] = None
     """Serialize JSON output into Pydantic model. The best is to use with json_mode"""
+    _tools_tokens: Dict[Tuple, int] = field(default_factory=dict, init=False, repr=False)
+    """Number of tokens of the tools definitions per tools and model"""
 
     def __init_subclass__(cls, **kwargs):
         """
@@ -102,10 +191,7 @@ class BaseAssistant:
 
     @property
     def encoding(self) -> Encoding:
-        try:
-            return encoding_for_model(self.model)
-        except KeyError:
-            return get_encoding("cl100k_base")
+        return _get_encoding(self.model)
 
     @property
     def model(self) -> str:
@@ -115,7 +201,6 @@ class BaseAssistant:
     def model(self, value: str):
         self._model = value
 
-    @lru_cache(maxsize=256)
     def _calc_tokens(self, text) -> int:
         """
         Calculate number of tokens from text.
@@ -123,8 +208,26 @@ class BaseAssistant:
         :param text:
         :return:
         """
+        if len(text) <= MAX_CACHED_TEXT_LEN:
+            return _encoded_len(self.model, text)
         return len(self.encoding.encode(text))
 
+    def _calc_tools_tokens(self) -> int:
+        """
+        Calculate number of tokens of the tools definitions.
+
+        The definitions are static, so the tools are initialized and encoded only once per tools and model.
+
+        :return: number of tokens
+        """
+        key = (tuple(self.tools), self.model)
+        if key not in self._tools_tokens:
+            self._tools_tokens[key] = sum(
+                self._calc_tokens(json.dumps(convert_to_openai_tool(tool)))
+                for tool in get_and_init_tools(self.tools, self)
+            )
+        return self._tools_tokens[key]
+
     def tokens_used(
         self, conv_id: Union[int, None] = None, hist: Union[List[BaseMessage], None] = None
     ) -> Dict[str, int]:
@@ -144,7 +247,7 @@ class BaseAssistant:
             "history": 0,
         }
         msgs = []
-        for msg in self._get_history(conv_id=conv_id) if not hist else hist:
+        for msg in self._get_history(conv_id=conv_id) if hist is None else hist:
             if isinstance(msg.content, str):
                 msgs.append(msg.content)
             else:
@@ -154,15 +257,44 @@ class BaseAssistant:
                         msgs.append(el["text"])
         ret["prompt"] += self._calc_tokens(self.prompt) + ADDITIONAL_TOKENS_PER_MSG
         if self.tools:
-            for tool in get_and_init_tools(self.tools, self):
-                ret["prompt"] += self._calc_tokens(json.dumps(convert_to_openai_tool(tool)))
-        ret["history"] += sum([self._calc_tokens(msg) for msg in msgs]) + len(msgs) * ADDITIONAL_TOKENS_PER_MSG
+            ret["prompt"] += self._calc_tools_tokens()
+        ret["history"] += self._calc_messages_tokens(msgs)
         return ret
 
-    def _get_history(self, conv_id: Union[int, None] = None) -> List[BaseMessage]:
-        ai_db = Db()
+    def _calc_messages_tokens(self, msgs: List[str]) -> int:
+        """
+        Calculate number of tokens of messages.
+
+        Short messages use the token count cache. Long messages are encoded in parallel threads in one call,
+        if there are enough of them to pay off the thread pool.
+
+        :param msgs: List of messages text
+        :return: number of tokens together with additional tokens per message
+        """
+        tokens = len(msgs) * ADDITIONAL_TOKENS_PER_MSG
+        long_msgs = []
+        for msg in msgs:
+            if len(msg) <= MAX_CACHED_TEXT_LEN:
+                tokens += _encoded_len(self.model, msg)
+            else:
+                long_msgs.append(msg)
+        if len(long_msgs) >= MIN_ENCODE_BATCH:
+            tokens += sum(map(len, self.encoding.encode_batch(long_msgs, num_threads=min(8, len(long_msgs)))))
+        else:
+            tokens += sum(len(self.encoding.encode(msg)) for msg in long_msgs)
+        return tokens
+
+    def _get_history(self, conv_id: Union[int, None] = None, ai_db: Db = None) -> List[BaseMessage]:
+        """
+        Get the conversation history from the database.
+
+        :param conv_id: Conversation Id. If None, empty history is returned
+        :param ai_db: Database controller to use, new one is created if None
+        :return: List of Human and AI messages
+        """
         if conv_id is None:
             return []
+        ai_db = ai_db or Db()
         if not ai_db.is_conversation_id_valid(conv_id):
             return []
         hist = []
@@ -186,20 +318,16 @@ class BaseAssistant:
         :param msg: The input message string containing text and image markdown.
         :return: A list of dictionaries representing formatted message segments.
         """
-        content = []
-        start_idx = 0
-        for m in IMAGE_DATA_URL_MARKDOWN_RE.finditer(msg):
-            img_start = m.start(0)
-            if img_start > 0:
-                content.append(dict(type="text", text=msg[start_idx:img_start]))
-            start_idx = m.end(0)
-            if image_data:
-                content.append(dict(type="image_url", image_url=dict(url=m.group("img_data"))))
-            else:
-                content.append(dict(type="text", text="generated image cannot be put here because of size"))
-        if msg[start_idx:]:
-            content.append(dict(type="text", text=msg[start_idx:]))
-        return content
+        # long messages and base64 images are not cached, not to keep them in memory
+        if len(msg) <= MAX_CACHED_TEXT_LEN and "data:" not in msg:
+            segments = _split_message_cached(msg, image_data)
+        else:
+            segments = _split_message(msg, image_data)
+        # the segments are shared by the calls, new dicts are created as LangChain can modify the content
+        return [
+            dict(type="image_url", image_url=dict(url=value)) if type_ == "image_url" else dict(type="text", text=value)
+            for type_, value in segments
+        ]
 
     def run(self, query: str, use_db=True, conv_id: Union[int, None] = None, **kwargs) -> AssistantResp:
         """
@@ -222,13 +350,16 @@ class BaseAssistant:
             else:
                 ai_db.new_conversation(assistant=self.name)
                 conv_id = ai_db.conv_id
-            hist = self._get_history(conv_id)
+            hist = self._get_history(conv_id, ai_db)
             ai_db.add_message(LlmMessageType.HUMAN, query)
         else:
             hist = []
             conv_id = None
 
-        used_tokens = self.tokens_used(conv_id, hist)
+        # a new conversation is counted with its just added query, as it is stored in the database
+        used_tokens = self.tokens_used(
+            conv_id, hist if hist or ai_db is None else [HumanMessage(content=self._format_message(query))]
+        )
         used_tokens["input"] = len(self.encoding.encode(query)) + ADDITIONAL_TOKENS_PER_MSG
         used_tokens["total_input"] = used_tokens["prompt"] + used_tokens["history"] + used_tokens["input"]
         used_tokens["output"] = 0
@@ -243,27 +374,32 @@ class BaseAssistant:
         used_tokens["total"] = sum([v for k, v in used_tokens.items() if k != "api"])
 
         ai_db.add_message(LlmMessageType.AI, ret) if ai_db else None
-        logger.info(f"{self.name}: ret={str(AssistantResp(conv_id, ret, used_tokens))[0:80]}...")
+        logger.info(f"{self.name}: {conv_id=}, ret={ret[0:80]}...")
         return AssistantResp(
             conv_id, self.pydantic_output.model_validate_json(ret) if self.pydantic_output else ret, used_tokens
         )
 
-    def _run_simple_assistant(self, query: str, hist: List, ai_db: Db, tokens, **kwargs) -> str:
-        """Run a simple assistant query."""
-        chat = chat_llm(
+    def _chat_llm(self):
+        """
+        Get the assistant LLM chat.
+
+        `chat_llm()` returns the same chat object for the same settings, so the HTTP connections are reused.
+
+        :return: LLM chat object
+        """
+        return chat_llm(
             force_api_type=self.force_api,
             model=self.model,
             temperature=float(self.temperature),
             max_tokens=float(self.max_tokens),
             json_mode=self.json_mode,
         )
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", self.prompt),
-                MessagesPlaceholder("hist", optional=True),
-                HumanMessage(content=self._format_message(query)),
-            ]
-        )
+
+    def _run_simple_assistant(self, query: str, hist: List, ai_db: Db, tokens, **kwargs) -> str:
+        """Run a simple assistant query."""
+        chat = self._chat_llm()
+        prompt = _assistant_template(self.prompt, with_tools=False)
+        kwargs["query"] = [HumanMessage(content=self._format_message(query))]
         kwargs["date"] = datetime.now().strftime("%Y-%m-%d")
         if hist:
             kwargs["hist"] = hist
@@ -276,21 +412,9 @@ class BaseAssistant:
 
     def _run_assistant_with_tools(self, query: str, hist: List, ai_db: Db, tokens, **kwargs) -> str:
         """Run an assistant with the tools query."""
-        llm = chat_llm(
-            force_api_type=self.force_api,
-            model=self.model,
-            temperature=float(self.temperature),
-            max_tokens=float(self.max_tokens),
-            json_mode=self.json_mode,
-        )
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", self.prompt),
-                MessagesPlaceholder("chat_history", optional=True),
-                HumanMessage(content=self._format_message(query)),
-                MessagesPlaceholder("agent_scratchpad"),
-            ]
-        )
+        llm = self._chat_llm()
+        prompt = _assistant_template(self.prompt, with_tools=True)
+        kwargs["query"] = [HumanMessage(content=self._format_message(query))]
         kwargs["date"] = datetime.now().strftime("%Y-%m-%d")
         if hist:
             kwargs["chat_history"] = hist
@@ -300,6 +424,9 @@ class BaseAssistant:
         agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=False)
         chunks = []
         action_msg_id = ""
+        # the tokens are counted at once when the agent finishes
+        output_msgs = []
+        tools_msgs = []
         for chunk in agent_executor.stream(kwargs, config={"callbacks": [langfuse_handler(["assistant", self.name])]}):
             chunks.append(chunk)
             # Agent Action
@@ -307,27 +434,22 @@ class BaseAssistant:
                 for message in chunk["messages"]:
                     if action_msg_id != message.id:
                         action_msg_id = message.id
-                        tokens["output"] += len(self.encoding.encode(message.content)) + ADDITIONAL_TOKENS_PER_MSG
+                        output_msgs.append(message.content)
                         ai_db.add_message(LlmMessageType.AI, message.content) if ai_db else None
                         self.callbacks["ai_observation"](message.content) if self.callbacks["ai_observation"] else None
                 for action in chunk["actions"]:
-                    tokens["tools"] += (
-                        len(
-                            self.encoding.encode(
-                                str(
-                                    dict(
-                                        function=dict(
-                                            arguments=action.tool_input,
-                                            name=action.tool,
-                                            id=action.tool_call_id,
-                                            index=0,
-                                            type="function",
-                                        )
-                                    )
+                    tools_msgs.append(
+                        str(
+                            dict(
+                                function=dict(
+                                    arguments=action.tool_input,
+                                    name=action.tool,
+                                    id=action.tool_call_id,
+                                    index=0,
+                                    type="function",
                                 )
                             )
                         )
-                        + ADDITIONAL_TOKENS_PER_MSG
                     )
                     msg = f"Invoking Tool: '{action.tool}' with input '{action.tool_input}'"
                     ai_db.add_message(LlmMessageType.TOOL, msg) if ai_db else None
@@ -335,7 +457,7 @@ class BaseAssistant:
             # Observation
             elif "steps" in chunk:
                 for step in chunk["steps"]:
-                    tokens["tools"] += len(self.encoding.encode(step.observation)) + ADDITIONAL_TOKENS_PER_MSG
+                    tools_msgs.append(step.observation)
                     msg = f"Tool Result: `{step.observation}`"
                     ai_db.add_message(LlmMessageType.TOOL, msg) if ai_db else None
                     self.callbacks["observation"](msg) if self.callbacks["observation"] else None
@@ -344,4 +466,6 @@ class BaseAssistant:
                 self.callbacks["output"](chunk["output"]) if self.callbacks["output"] else None
             else:
                 raise ValueError()
+        tokens["output"] += self._calc_messages_tokens(output_msgs)
+        tokens["tools"] += self._calc_messages_tokens(tools_msgs)
         return chunks[-1]["output"]
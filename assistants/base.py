@@ -8,7 +8,7 @@ from typing import Dict, TypeAlias
 import yaml
 from dotenv import load_dotenv, find_dotenv
 
-from libs.utils import import_module, find_lands
+from libs.utils import import_module, find_lands, read_beings, SafeLoader
 from assistants.assistant import BaseAssistant, AssistantType
 from tools.base import get_available_tools
 
@@ -33,19 +33,17 @@ class Assistants(Dict[str, BaseAssistant]):
         assistant_sets = find_lands("assistants", Path(__file__).parent)
 
         for assistant_set in assistant_sets:
-            for assistant in sorted(assistant_set.glob("*")):
+            for assistant, prompt, config in read_beings(assistant_set):
                 if self.get(assistant.name) is not None:
                     logger.error(f"'{assistant.name}` assistant already exist")
                     continue
-                if not (assistant.is_dir() and (assistant / "prompt.md").exists()):
+                if prompt is None:
                     logger.debug(f"This is not assistant folder:{assistant}")
                     continue
-                prompt = (assistant / "prompt.md").read_text()
                 assistant_cls = BaseAssistant
                 settings = {}
-                if (assistant / "config.yaml").exists():
-                    with open(assistant / "config.yaml") as fd:
-                        settings = yaml.safe_load(fd.read())
+                if config is not None:
+                    settings = yaml.load(config, Loader=SafeLoader)
                     settings["type"] = AssistantType.SIMPLE
                     if settings.get("tools", None):
                         settings["tools"] = [x.lower() for x in settings["tools"]]
@@ -79,9 +77,7 @@ class Assistants(Dict[str, BaseAssistant]):
                     settings["contexts"] = contexts
 
                     prompt += "\nTake into consideration the context below while generating answers.\n# Context:"
-                    for idx, context in enumerate(contexts):
-                        prompt += f"\n## {idx}"
-                        prompt += "\n" + context
+                    prompt += "".join(f"\n## {idx}\n{context}" for idx, context in enumerate(contexts))
 
                     if settings.get("model", None):
                         settings["_model"] = settings.pop("model")
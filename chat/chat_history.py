@@ -8,6 +8,7 @@ import subprocess
 import sys
 import tkinter as tk
 import webbrowser
+from concurrent.futures import Future
 from io import BytesIO
 from pathlib import Path
 from tkinter import ttk, messagebox
@@ -32,7 +33,7 @@ from libs.utils import (
     str_shortening,
     prepare_message,
     to_md,
-    grabclipboard,
+    grabclipboard_async,
     IMAGE_DATA_URL_MARKDOWN_RE,
     _convert_data_url_to_file_url,
 )
@@ -403,10 +404,21 @@ class UserQuery(ttk.Frame):
 
         :param args: Additional arguments (unused).
         :return: None
-        :raises UnidentifiedImageError: If the clipboard content is not an image.
         """
+        self._insert_clipboard_image(grabclipboard_async())
+
+    def _insert_clipboard_image(self, future: Future):
+        """
+        Insert the clipboard image into text widget when it has been grabbed in background.
+
+        :param future: Future with clipboard image or None
+        :return: None
+        """
+        if not future.done():
+            self.after(50, self._insert_clipboard_image, future)
+            return
         try:
-            im = grabclipboard()
+            im = future.result()
             if im:
                 with BytesIO() as buffer:
                     im.save(buffer, format="PNG")
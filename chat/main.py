@@ -45,6 +45,7 @@ from libs.utils import (
     IMAGE_DATA_URL_MARKDOWN_RE,
     _convert_data_url_to_file_url,
     kraina_db,
+    SafeLoader,
 )
 from snippets.base import Snippets
 from snippets.snippet import BaseSnippet
@@ -534,7 +535,7 @@ class App(TkinterDnD.Tk):
 
         with open(persist_file, "r") as fd:
             try:
-                data = yaml.load(fd, Loader=yaml.SafeLoader)["chat"]
+                data = yaml.load(fd, Loader=SafeLoader)["chat"]
                 chat_persistence.SETTINGS = replace(
                     chat_persistence.SETTINGS,
                     **{k: v for k, v in data.items() if k in chat_persistence.SETTINGS.keys()},
@@ -554,7 +555,7 @@ class App(TkinterDnD.Tk):
 
         with open(settings_file, "r") as fd:
             try:
-                data = yaml.load(fd, Loader=yaml.SafeLoader)["chat"]
+                data = yaml.load(fd, Loader=SafeLoader)["chat"]
                 chat_settings.SETTINGS = replace(
                     chat_settings.SETTINGS,
                     **{k: v for k, v in data.items() if k in chat_settings.SETTINGS.keys()},
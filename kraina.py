@@ -57,8 +57,7 @@ if __name__ == "__main__":
     if args.text == "" and args.snippet == "" and args.file == "":
         print(",".join(snippets.keys()))
     else:
-        desktop_notify = notifier_factory()(f"KrAina: {args.snippet}")
-        desktop_notify.start()
+        desktop_notify = None
         try:
             if args.file:
                 if not (p := Path(args.file)).exists():
@@ -71,6 +70,9 @@ if __name__ == "__main__":
             else:
                 snippet = args.snippet
                 query = args.text
+            # notify only when the snippet is really run, not on early errors
+            desktop_notify = notifier_factory()(f"KrAina: {snippet}")
+            desktop_notify.start()
             ret = snippets[snippet].run(query)
             # workaround for Windows exception: 'charmap' codec can't encode character
             print(ret.encode("utf-8").decode(sys.stdout.encoding, errors="ignore"))
@@ -78,4 +80,5 @@ if __name__ == "__main__":
             logger.exception(e)
             exit(1)
         finally:
-            desktop_notify.join()
+            if desktop_notify is not None:
+                desktop_notify.join()
@@ -4,7 +4,7 @@ Initialize the langfuse callback handler.
 Set up the langfuse callback handler using environment variables.
 If the LANGFUSE_HOST environment variable is set, it initializes the handler with
 the provided public key, secret key, and host.
-Otherwise, it initializes empty handler.
+Otherwise, the handler is a shared no-op handler, so no langfuse client is created per LLM call.
 """
 
 import logging
@@ -12,6 +12,7 @@ import os
 import uuid
 
 from dotenv import find_dotenv, load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
 from langfuse.callback import CallbackHandler
 from langfuse.decorators import langfuse_context
 
@@ -38,5 +39,6 @@ else:
     langfuse_context.configure(
         enabled=False,
     )
-    langfuse_handler = lambda tags: CallbackHandler()
+    _noop_handler = BaseCallbackHandler()
+    langfuse_handler = lambda tags: _noop_handler
     logger.info("langfuse NOT active")
@@ -1,20 +1,34 @@
 """LLM handling."""
 
+import atexit
 import enum
 import logging
 import os
+import pickle
+import threading
+import uuid
+from dataclasses import dataclass, fields
+from functools import lru_cache
 from pathlib import Path
-from typing import Union
+from typing import Any, List, Tuple, Union
 
 import yaml
 from langchain_anthropic import ChatAnthropic
 from langchain_aws import ChatBedrock, BedrockEmbeddings
+from langchain_core.caches import BaseCache
 from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_openai import ChatOpenAI, AzureChatOpenAI, OpenAIEmbeddings, AzureOpenAIEmbeddings
 from langfuse.openai import OpenAI, AzureOpenAI
 from langchain_voyageai import VoyageAIEmbeddings
 from langchain_ollama import ChatOllama
 
+try:
+    # libyaml based loader is much faster, but it's optional in PyYAML
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,12 +43,33 @@ class MyChatOllama(ChatOllama):
         super().__init__(*args, **kwargs)
 
 
-OVERWRITE_LLM_SETTINGS = {
-    "model": "",
-    "api_type": "",
-    "temperature": "",
-    "max_tokens": "",
-}
+@dataclass(slots=True)
+class OverwriteLlmSettings:
+    """LLM settings overwritten by the Chat application. Empty string means not overwritten."""
+
+    model: str = ""
+    api_type: str = ""
+    temperature: str = ""
+    max_tokens: str = ""
+
+    def update_kwargs(self, kwargs: dict) -> dict:
+        """
+        Put overwritten model, temperature and max_tokens into kwargs.
+
+        :param kwargs: LLM object keyword arguments
+        :return: updated kwargs
+        """
+        if self.model != "":
+            kwargs["model"] = self.model
+        if self.temperature != "":
+            kwargs["temperature"] = self.temperature
+        if self.max_tokens != "":
+            kwargs["max_tokens"] = self.max_tokens
+        return kwargs
+
+
+OVERWRITE_LLM_SETTINGS = OverwriteLlmSettings()
+_OVERWRITE_LLM_SETTINGS_FIELDS = frozenset(f.name for f in fields(OverwriteLlmSettings))
 
 
 class SUPPORTED_API_TYPE(enum.Enum):
@@ -62,7 +97,7 @@ def read_model_settings():
     """
     if (Path(__file__).parent / "../config.yaml").exists():
         with open(Path(__file__).parent / "../config.yaml") as fd:
-            settings = yaml.safe_load(fd.read())
+            settings = yaml.load(fd, Loader=SafeLoader)
         if settings.get("llm") and settings["llm"].get("map_model"):
             MAP_MODELS.update({SUPPORTED_API_TYPE(k): v for k, v in settings["llm"]["map_model"].items()})
     logger.debug(MAP_MODELS)
@@ -79,8 +114,9 @@ def overwrite_llm_settings(**new_settings):
     :return:
     """
     for k, v in new_settings.items():
-        if OVERWRITE_LLM_SETTINGS.get(k) is not None:
-            OVERWRITE_LLM_SETTINGS[k] = v
+        # only the settings, methods and dunder attributes must not be overwritten
+        if k in _OVERWRITE_LLM_SETTINGS_FIELDS:
+            setattr(OVERWRITE_LLM_SETTINGS, k, v)
 
 
 def map_model(model: str, api_force: Union[SUPPORTED_API_TYPE, str] = None) -> str:
@@ -115,27 +151,162 @@ def get_llm_type(force_api_type: Union[SUPPORTED_API_TYPE, str] = None) -> SUPPO
         os_env_anthropic_ok = bool(os.environ.get("ANTHROPIC_API_KEY"))
         os_env_aws_ok = bool(os.environ.get("BEDROCK_AWS_SECRET_ACCESS_KEY"))
 
-        if OVERWRITE_LLM_SETTINGS["api_type"]:
-            ret = OVERWRITE_LLM_SETTINGS["api_type"]
-        elif OVERWRITE_LLM_SETTINGS["api_type"] == "" and os_env_azure_ok:
+        if OVERWRITE_LLM_SETTINGS.api_type:
+            ret = OVERWRITE_LLM_SETTINGS.api_type
+        elif os_env_azure_ok:
             # Application does not force, so check env variable
             # if AZURE env variable exists, select azure
             ret = SUPPORTED_API_TYPE.AZURE
-        elif OVERWRITE_LLM_SETTINGS["api_type"] == "" and os_env_openai_ok:
+        elif os_env_openai_ok:
             ret = SUPPORTED_API_TYPE.OPENAI
-        elif OVERWRITE_LLM_SETTINGS["api_type"] == "" and os_env_anthropic_ok:
+        elif os_env_anthropic_ok:
             ret = SUPPORTED_API_TYPE.ANTHROPIC
         else:
             ret = SUPPORTED_API_TYPE.AWS
     return SUPPORTED_API_TYPE(ret) if isinstance(ret, str) else ret
 
 
+LLM_CACHE_PATH = Path(__file__).parent / "../.store_files/llm_cache.db"
+LLM_CACHE_MAX_SIZE = 64 * 1024 * 1024
+"""The disk cache bigger than this (in bytes) is removed on application start, it has no expiry"""
+
+
+@lru_cache(maxsize=1)
+def llm_cache() -> BaseCache:
+    """
+    Get the disk cache of LLM responses, created on first use.
+
+    Langchain keys the cache with the prompt and all LLM settings (model, temperature, max_tokens, ...).
+    Do not use it for requests with images, the whole base64 image is a part of the key.
+
+    :return: SQLite cache
+    """
+    from langchain_community.cache import SQLiteCache
+
+    LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    if LLM_CACHE_PATH.exists() and LLM_CACHE_PATH.stat().st_size > LLM_CACHE_MAX_SIZE:
+        logger.info(f"LLM cache is bigger than {LLM_CACHE_MAX_SIZE} bytes, start from scratch")
+        LLM_CACHE_PATH.unlink()
+    return SQLiteCache(database_path=str(LLM_CACHE_PATH))
+
+
+SEMANTIC_CACHE_PATH = Path(__file__).parent / "../.store_files/semantic_cache"
+SEMANTIC_CACHE_DUMP_EVERY = 16
+"""Semantic cache is dumped to disk every this number of new responses and on application exit"""
+
+
+class SemanticCache:
+    """
+    Cache of LLM responses for similar queries.
+
+    The queries are embedded and kept in the vector store together with the responses.
+    The store is dumped into `.store_files/semantic_cache` folder.
+    """
+
+    def __init__(self, name: str, embed: Embeddings):
+        """
+        Initialize semantic cache and load it from the disk, if dumped before.
+
+        :param name: Cache name, one cache per snippet, its system prompt and LLM settings
+        :param embed: Embedding object used to embed the queries
+        """
+        self._embed = embed
+        self._file = SEMANTIC_CACHE_PATH / f"{name.replace('/', '_')}.pkl"
+        self._lock = threading.Lock()
+        self._store = InMemoryVectorStore(embed)
+        if self._file.exists():
+            try:
+                with open(self._file, "rb") as fd:
+                    self._store.store = pickle.load(fd)
+            except Exception as e:
+                # corrupted or incompatible dump, the cache is only an optimisation, start from scratch
+                logger.warning(f"semantic cache {self._file} cannot be loaded, start empty: {e}")
+        self._not_dumped = 0
+        atexit.register(self.dump)
+
+    def lookup(self, query: str, threshold: float) -> Tuple[Union[str, None], List[float]]:
+        """
+        Find the response of the most similar query.
+
+        :param query: Query to LLM
+        :param threshold: Minimal cosine similarity of the queries to return cached response
+        :return: Tuple of cached response or None if not found and query embedding, to be reused by `update()`.
+                 The embedding is None if the query cannot be embedded.
+        """
+        try:
+            vector = self._embed.embed_query(query)
+        except Exception as e:
+            # the cache must not fail the LLM request, treat it as a miss
+            logger.warning(f"semantic cache lookup failed, query not embedded: {e}")
+            return None, None
+        with self._lock:
+            results = self._store.similarity_search_with_score_by_vector(vector, k=1)
+        if results and results[0][1] >= threshold:
+            logger.debug(f"semantic cache hit, similarity={results[0][1]}")
+            return results[0][0].metadata["response"], vector
+        logger.debug("semantic cache miss")
+        return None, vector
+
+    def update(self, query: str, vector: List[float], response: str):
+        """
+        Add the query and its response into the cache, the cache is dumped to disk every few updates.
+
+        :param query: Query to LLM
+        :param vector: Query embedding returned by `lookup()`, nothing is cached if None
+        :param response: LLM response
+        :return:
+        """
+        if vector is None:
+            return
+        doc_id = str(uuid.uuid4())
+        with self._lock:
+            self._store.store[doc_id] = dict(id=doc_id, vector=vector, text=query, metadata=dict(response=response))
+            self._not_dumped += 1
+            if self._not_dumped < SEMANTIC_CACHE_DUMP_EVERY:
+                return
+        self.dump()
+
+    def dump(self):
+        """
+        Dump the cache to disk, if there are new responses.
+
+        :return:
+        """
+        with self._lock:
+            if not self._not_dumped:
+                return
+            try:
+                self._file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self._file, "wb") as fd:
+                    pickle.dump(self._store.store, fd, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                # called also on exit, log only, the responses are kept in memory for the next dump
+                logger.warning(f"semantic cache {self._file} cannot be dumped: {e}")
+                return
+            self._not_dumped = 0
+
+
+@lru_cache(maxsize=None)
+def semantic_cache(name: str, force_api_type: str = None) -> SemanticCache:
+    """
+    Get the semantic cache, created and loaded from the disk on first use.
+
+    :param name: Cache name, it must contain the embedding model
+    :param force_api_type: azure or openai or anthropic - force API type of embedding model
+    :return: SemanticCache object
+    """
+    # the chat model, temperature and max_tokens selected in the Chat application are not for the embedding model
+    return SemanticCache(name, embedding(force_api_type=force_api_type, model="embed", overwrite_settings=False))
+
+
 def chat_llm(**kwargs) -> Union[ChatOpenAI, AzureChatOpenAI, ChatAnthropic]:
     """
 
     :param kwargs:
              force_api_type: azure or openai or anthropic - force API type
              json_mode: True if response_format=json_object, False if the text. Default is text
+             cache_deterministic: True to cache responses on disk when temperature is 0. Default is False.
+                                  Do not use with images.
              ... - pass to the chat object
     :return:
     """
@@ -143,10 +314,28 @@ def chat_llm(**kwargs) -> Union[ChatOpenAI, AzureChatOpenAI, ChatAnthropic]:
     kwargs.pop("force_api_type", None)
     json_mode = kwargs.get("json_mode", False)
     kwargs.pop("json_mode", None)
-    for k, v in OVERWRITE_LLM_SETTINGS.items():
-        if k not in ["api_type"] and OVERWRITE_LLM_SETTINGS.get(k, "") != "":
-            kwargs[k] = v
+    cache_deterministic = kwargs.pop("cache_deterministic", False)
+    OVERWRITE_LLM_SETTINGS.update_kwargs(kwargs)
+    if cache_deterministic and float(kwargs.get("temperature", 1)) == 0:
+        # the same query returns the same response, no need to ask LLM again
+        kwargs["cache"] = llm_cache()
     kwargs["model"] = map_model(kwargs["model"], force)
+    return _chat_llm(get_llm_type(force), json_mode, tuple(sorted(kwargs.items())))
+
+
+@lru_cache(maxsize=32)
+def _chat_llm(api_type: SUPPORTED_API_TYPE, json_mode: bool, settings: Tuple[Tuple[str, Any], ...]):
+    """
+    Create the chat object, once per API type and settings.
+
+    The chat objects are not modified by callers and are safe to be used by many threads,
+    so they are shared together with their HTTP connection pools.
+
+    :param api_type: API type
+    :param json_mode: True if response_format=json_object
+    :param settings: sorted (key, value) pairs passed to the chat object
+    :return: chat object
+    """
     models = {
         SUPPORTED_API_TYPE.AZURE: AzureChatOpenAI,
         SUPPORTED_API_TYPE.OPENAI: ChatOpenAI,
@@ -154,14 +343,14 @@ def chat_llm(**kwargs) -> Union[ChatOpenAI, AzureChatOpenAI, ChatAnthropic]:
         SUPPORTED_API_TYPE.AWS: ChatBedrock,
         SUPPORTED_API_TYPE.OLLAMA: MyChatOllama,
     }
-    if json_mode and get_llm_type(force) not in (
+    if json_mode and api_type not in (
         SUPPORTED_API_TYPE.ANTHROPIC,
         SUPPORTED_API_TYPE.AWS,
         SUPPORTED_API_TYPE.OLLAMA,
     ):
-        return models[get_llm_type(force)](**kwargs).bind(response_format={"type": "json_object"})  # noqa
+        return models[api_type](**dict(settings)).bind(response_format={"type": "json_object"})  # noqa
     else:
-        return models[get_llm_type(force)](**kwargs)
+        return models[api_type](**dict(settings))
 
 
 def embedding(**kwargs) -> Embeddings:
@@ -174,6 +363,7 @@ def embedding(**kwargs) -> Embeddings:
     :param kwargs: Arbitrary keyword arguments for embedding configuration.
                    - force_api_type: Optional; forces the use of a specific API type.
                    - model: Required; specifies the model to be used for embeddings.
+                   - overwrite_settings: Optional; apply Chat application LLM settings. Default is True
     :return: An instance of the appropriate embedding class.
     :raises KeyError: If 'model' is not provided in kwargs.
     """
@@ -183,9 +373,8 @@ def embedding(**kwargs) -> Embeddings:
         kwargs.pop("force_api_type")
     except KeyError:
         pass
-    for k, v in OVERWRITE_LLM_SETTINGS.items():
-        if k not in ["api_type"] and OVERWRITE_LLM_SETTINGS.get(k, "") != "":
-            kwargs[k] = v
+    if kwargs.pop("overwrite_settings", True):
+        OVERWRITE_LLM_SETTINGS.update_kwargs(kwargs)
     kwargs["model"] = map_model(kwargs["model"], force)
     embeddings = {
         SUPPORTED_API_TYPE.AZURE: AzureOpenAIEmbeddings,
@@ -209,9 +398,7 @@ def llm_client(**kwargs) -> Union[OpenAI, AzureOpenAI]:
         kwargs.pop("force_api_type")
     except KeyError:
         pass
-    for k, v in OVERWRITE_LLM_SETTINGS.items():
-        if k not in ["api_type"] and OVERWRITE_LLM_SETTINGS.get(k, "") != "":
-            kwargs[k] = v
+    OVERWRITE_LLM_SETTINGS.update_kwargs(kwargs)
     llm = {
         SUPPORTED_API_TYPE.AZURE: AzureOpenAI,
         SUPPORTED_API_TYPE.OPENAI: OpenAI,
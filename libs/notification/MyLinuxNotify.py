@@ -1,6 +1,5 @@
 import threading
 import time
-from collections import namedtuple
 
 import gi
 
@@ -13,8 +12,8 @@ from gi.repository import Notify
 class LinuxNotify(threading.Thread, NotifierInterface):
     def __init__(self, summary: str):
         super().__init__()
-        self._dot = namedtuple("dot", ("empty", "full"))("⚫", "⚪")
-        self._bar = [self._dot.empty] * 8
+        # all possible progress bar frames, the full dot moves from left to right
+        self._frames = ["".join(["⚫"] * i + ["⚪"] + ["⚫"] * (7 - i)) for i in range(8)]
         self._summary = summary
         Notify.init(summary)
         self._event = threading.Event()
@@ -28,12 +27,11 @@ class LinuxNotify(threading.Thread, NotifierInterface):
         inf.show()
         i = 0
         while not self._event.is_set():
-            idx = i % len(self._bar)
-            self._bar[idx] = self._dot.full
-            inf.update(self._summary, "".join(self._bar))
+            inf.update(self._summary, self._frames[i & 7])
             inf.show()
-            time.sleep(0.3)
-            self._bar[idx] = self._dot.empty
+            # wake up immediately when join() is called instead of sleeping the whole tick
+            if self._event.wait(0.3):
+                break
             i += 1
         inf.update(self._summary, "Done")
         inf.show()
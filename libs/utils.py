@@ -1,5 +1,6 @@
 """Set of utils functions and classes."""
 
+import contextlib
 import hashlib
 import importlib.util
 import io
@@ -10,26 +11,32 @@ import subprocess
 import sys
 import os
 import tempfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 from functools import lru_cache
 from pathlib import Path
 from types import ModuleType
-from typing import Any, List, Dict, Tuple
+from typing import Any, List, Dict, Tuple, Union
 
-import markdown2
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from markdown_it import MarkdownIt
+from markdown_it.rules_inline import emphasis
 from PIL import Image, ImageColor
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 
-# mermind prints `Warning: IPython is not installed. Mermaidjs magic function is not available.`
-# and we don't want to see this
-original_stdout = sys.stdout
-sys.stdout = None
-import mermaid as md
-from mermaid.graph import Graph
+try:
+    # libyaml based loader is much faster, but it's optional in PyYAML
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
-sys.stdout = original_stdout
 
 
 import chat.chat_images as chat_images
@@ -37,46 +44,159 @@ import chat.chat_images as chat_images
 logger = logging.getLogger(__name__)
 
 
-IMAGE_DATA_URL_MARKDOWN_RE = re.compile(r"!\[(?P<img_name>img-[^]]+)\]\((?P<img_data>data:image/[^\)]+)\)")
-IMAGE_MARKDOWN_RE = re.compile(r"!\[(?P<img_name>[^]]+)]\((?P<img_url>(https|file)://[^\)]+)\)")
+# image names and URLs are bounded to limit backtracking on malformed input, data URLs can be huge so are not
+IMAGE_DATA_URL_MARKDOWN_RE = re.compile(r"!\[(?P<img_name>img-[^]]{1,1024})\]\((?P<img_data>data:image/[^\)]+)\)")
+IMAGE_MARKDOWN_RE = re.compile(r"!\[(?P<img_name>[^]]{1,1024})]\((?P<img_url>(https|file)://[^\)]{1,4096})\)")
+# Both image types in one pass. Group names must be unique, so the name of URL image is `url_name`
+IMAGE_ANY_MARKDOWN_RE = re.compile(
+    IMAGE_DATA_URL_MARKDOWN_RE.pattern + "|" + IMAGE_MARKDOWN_RE.pattern.replace("?P<img_name>", "?P<url_name>")
+)
 MERMAID_RE = re.compile(r"```\s?(?:mermaid|mmd)\n(?P<graph>[\s\S]*?)```")
 LATEX_RE = re.compile(
     r"\\\[(?P<latex>.*?)\\\]|\\\((?P<latex2>.*?)\\\)",
     re.DOTALL,  # Enable multiline matching with dot matching newlines
 )
 
+# Regular expressions for URL and file paths
+URL_PATTERN = r"https?://[^\s)\",'`]+"
+POSIX_PATH_PATTERN = r"/[^)\s]+\.[^)\s\",'`]+"
+WINDOWS_PATH_PATTERN = r"[a-zA-Z]:\\[^)\",'`\s]+"
+# One capturing group, so re.split() returns text and hyperlinks interleaved: text at even, hyperlinks at odd indexes
+HYPERLINK_RE = re.compile(f"({URL_PATTERN}|{POSIX_PATH_PATTERN}|{WINDOWS_PATH_PATTERN})")
+
+# Any character which can change the markdown rendering of one line of text or white spaces around the text
+MARKDOWN_MARKERS_RE = re.compile(r"[`*_#\[\]!|>~\-+=<&\\\n\r\x00]|^[\s\d]|\s$")
+
+CODE_FORMATTER = HtmlFormatter(cssclass="codehilite", wrapcode=True)
+
+
+def _render_fence(self, tokens, idx, options, env) -> str:
+    """Render fenced code block with language using pygments, the same as the codehilite used by chat CSS."""
+    info = tokens[idx].info.strip()
+    if info:
+        try:
+            return highlight(tokens[idx].content, get_lexer_by_name(info.split(maxsplit=1)[0]), CODE_FORMATTER)
+        except ClassNotFound:
+            pass
+    return self.fence(tokens, idx, options, env)
+
+
+def _emphasis_no_underscore(state, silent: bool) -> bool:
+    """
+    Parse `*` emphasis only, `_` is plain text.
+
+    The same as `code-friendly` extra of markdown2, `__init__` or `snake_case_name` outside backticks
+    are not rendered as bold or italic.
+    """
+    if state.src[state.pos] == "_":
+        return False
+    return emphasis.tokenize(state, silent)
+
+
+MARKDOWN = MarkdownIt("commonmark", {"html": True}).enable("table")
+MARKDOWN.inline.ruler.at("emphasis", _emphasis_no_underscore)
+MARKDOWN.add_render_rule("fence", _render_fence)
+
+# Shared pool for rendering mermaid graphs and latex formulas
+_RENDER_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="render")
+# Keep-alive connections to LaTeX rendering API, reused by all rendering threads
+_LATEX_SESSION = requests.Session()
+_LATEX_SESSION.mount(
+    "https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2))
+)
+
+
+_mermaid_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def import_mermaid() -> Tuple[ModuleType, type]:
+    """
+    Import mermaid package on first use, it's heavy and only needed to render mermaid graphs.
+
+    :return: mermaid module and mermaid Graph class
+    """
+    # mermind prints `Warning: IPython is not installed. Mermaidjs magic function is not available.`
+    # and we don't want to see this. Lock as stdout is redirected globally and graphs are rendered in threads.
+    with _mermaid_lock, contextlib.redirect_stdout(io.StringIO()):
+        import mermaid
+        from mermaid.graph import Graph
+    return mermaid, Graph
+
+
+_import_cache: Dict[str, Tuple[int, ModuleType]] = {}
+"""Modules imported by `import_module`, path: (file modification time, module)"""
+
 
 def import_module(path: Path) -> ModuleType:
     """
     Dynamically import a module form path.
 
+    The module is executed again only if the file was modified since the last import.
+    Module is registered as `<parent folder>.<file stem>`, so it never shadows top-level packages
+    (e.g. all macros were registered as `macros`) and modules from different folders do not collide.
+
     :param path: Path to Python module file
     :return: module
     """
-    module_name = path.parent.name
+    module_name = f"{path.parent.name}.{path.stem}"
+    mtime = path.stat().st_mtime_ns
+    cached = _import_cache.get(str(path))
+    if cached and cached[0] == mtime:
+        # file not changed since last import, don't execute it again
+        sys.modules[module_name] = cached[1]
+        return cached[1]
     spec = importlib.util.spec_from_file_location(module_name, str(path), submodule_search_locations=[str(path.parent)])
     sys.modules[module_name] = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(sys.modules[module_name])
+    _import_cache[str(path)] = (mtime, sys.modules[module_name])
     return sys.modules[module_name]
 
 
-@lru_cache(maxsize=1024)
 def str_shortening(data: Any, limit=256) -> str:
     """
     Return a short version of data truncated if data length > limits.
 
+    Only the kept head and tail are transformed, so the cost does not depend on the data length.
+
     :param data:
     :param limit:
     :return:
     """
-    data = str(data).replace("\n", "\\n").replace("img-", "IMG-")
+    data = str(data)
     if len(data) > limit:
+        half = limit // 2
         return (
-            data[0 : int(limit / 2)]
-            + f"... ({len(data) - (2 * limit)} truncated) ..."
-            + data[len(data) - int(limit / 2) :]
+            data[0:half].replace("\n", "\\n").replace("img-", "IMG-")
+            + f"... ({len(data) - 2 * half} truncated) ..."
+            + data[len(data) - half :].replace("\n", "\\n").replace("img-", "IMG-")
         )
-    return data
+    if "\n" not in data and "img-" not in data:
+        return data
+    return data.replace("\n", "\\n").replace("img-", "IMG-")
+
+
+@lru_cache(maxsize=4096)
+def content_key(data: str) -> str:
+    """
+    Return the name of the image rendered from mermaid graph or latex formula.
+
+    :param data: mermaid graph or latex formula
+    :return: md5 hex digest of the first 124 characters of data
+    """
+    return hashlib.md5(data[0:124].encode()).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def image_size(name: str, mode: str) -> Tuple[int, int]:
+    """
+    Return the size of the chat image. Images are named by content, so the size never changes.
+
+    :param name: chat image name
+    :param mode: one of the chat image versions, e.g. resized-150
+    :return: width, height
+    """
+    return chat_images.chat_images.pil_image[name][mode].size
 
 
 def replace_latex(text: str) -> Tuple[str, Dict[str, str]]:
@@ -107,32 +227,45 @@ def replace_latex(text: str) -> Tuple[str, Dict[str, str]]:
     return text, code_map
 
 
-def replace_text(text: str, patterns: list[str]) -> Tuple[str, Dict[str, str]]:
+def replace_code_blocks(text: str) -> Tuple[str, Dict[str, str]]:
     """
-    Replace code blocks in a text with placeholders.
+    Replace fenced (```) and inline (`) code blocks in a text with placeholders.
 
-    This function searches for code blocks in the input text using the provided patterns,
-    replaces them with unique placeholders, and stores the original code blocks in a map.
+    The text is scanned forward with `str.find` instead of regex, so unbalanced or long runs of backticks
+    are handled in linear time. Fenced blocks are replaced first, then inline code in the remaining text.
 
     :param text: The input text containing code blocks to be replaced.
-    :param patterns: A list of regex patterns to identify code blocks.
     :return: A tuple containing the modified text with placeholders and a dictionary
              mapping placeholders to original code blocks.
     """
-    # Store original code blocks
     code_map = {}
     counter = 0
 
-    def _replace(m):
+    def _scan(text_: str, delimiter: str, allow_empty: bool) -> str:
         nonlocal counter
-        placeholder = f"__\xd7_{counter}__"
-        code_map[placeholder] = m.group(0)
-        counter += 1
-        return placeholder
-
-    for pattern in patterns:
-        text = re.sub(pattern, _replace, text)
-
+        parts = []
+        pos = 0
+        while (start := text_.find(delimiter, pos)) != -1:
+            end = text_.find(delimiter, start + len(delimiter))
+            if end == -1:
+                break
+            if not allow_empty and end == start + len(delimiter):
+                # empty inline code is not code, the closing backtick can open the next one
+                parts.append(text_[pos:end])
+                pos = end
+                continue
+            end += len(delimiter)
+            placeholder = f"__\xd7_{counter}__"
+            code_map[placeholder] = text_[start:end]
+            counter += 1
+            parts.append(text_[pos:start])
+            parts.append(placeholder)
+            pos = end
+        parts.append(text_[pos:])
+        return "".join(parts)
+
+    text = _scan(text, "```", True)
+    text = _scan(text, "`", False)
     return text, code_map
 
 
@@ -147,13 +280,13 @@ def restore_text(modified_text: str, code_map: Dict[str, str]) -> str:
     Returns:
         str: Original text with code blocks restored
     """
-    restored_text = modified_text
+    # all placeholders start with the same prefix, nothing to restore without it
+    if not code_map or "__\xd7_" not in modified_text:
+        return modified_text
 
     # Sort placeholders by length (longest first) to avoid partial replacements
-    for placeholder in sorted(code_map.keys(), key=len, reverse=True):
-        restored_text = restored_text.replace(placeholder, code_map[placeholder])
-
-    return restored_text
+    pattern = re.compile("|".join(re.escape(k) for k in sorted(code_map.keys(), key=len, reverse=True)))
+    return pattern.sub(lambda m: code_map[m.group(0)], modified_text)
 
 
 @lru_cache(maxsize=256)
@@ -161,57 +294,75 @@ def to_md(text: str, col: str = None) -> str:
     """
     Convert markdown text to HTML with optional color styling.
 
-    This function uses markdown2 to convert the input markdown text to HTML. If a color is specified,
+    This function uses markdown-it to convert the input markdown text to HTML. If a color is specified,
     the resulting HTML will be wrapped in a span with the specified color.
 
     :param text: The markdown text to be converted.
     :param col: Optional. The color to apply to the HTML content.
     :return: The converted HTML string, optionally styled with the specified color.
     """
+    if not MARKDOWN_MARKERS_RE.search(text):
+        # plain one line text, render the paragraph the same way as markdown-it does
+        html = f"<p>{text}</p>\n".replace('"', "&quot;") if text else ""
+        return f'<span style="color:{col}">{html}</span>' if col else html
 
     def insert_img(m: re.Match) -> str:
-        """Convert Markdown image line into HTML. If image don't exists, create it."""
+        """Convert Markdown image line into HTML. If data URL image don't exists, create it."""
+        if m.group("img_data") is None:
+            width, height = 256, 256
+            return f'<img src="{m.group("img_url")}" alt="{m.group("url_name")}" width="{width}" height="{height}"/>'
         name = chat_images.chat_images.create_from_url(m.group("img_data"), m.group("img_name"))
-        width, height = chat_images.chat_images.pil_image[name]["resized-150"].size
+        width, height = image_size(name, "resized-150")
         return f'<img src="{m.group("img_data")}" alt="{m.group("img_name")}" width="{width}" height="{height}"/>'
 
-    def insert_img_wh(m: re.Match) -> str:
-        width, height = 256, 256
-        return f'<img src="{m.group("img_url")}" alt="{m.group("img_name")}" width="{width}" height="{height}"/>'
-
     def insert_mermaid(m: re.Match) -> str:
-        name = hashlib.md5(m.group("graph")[0:124].encode()).hexdigest()
+        name = content_key(m.group("graph"))
         if chat_images.chat_images.get(name):
-            width, height = chat_images.chat_images.pil_image[name]["resized-600"].size
+            width, height = image_size(name, "resized-600")
             return f'<img src="{chat_images.chat_images.get_file_url(name)}" alt="{name}" width="{width}" height="{height}"/>'
         else:
-            graph = Graph("first-graph", m.group("graph"))
+            md, graph_cls = import_mermaid()
+            graph = graph_cls("first-graph", m.group("graph"))
             temp = md.Mermaid(graph)
             if temp.img_response.status_code == 200:
+                # ImageTk must be False, as ImageTk.PhotoImage is not thread-safely
                 name = chat_images.chat_images.create_from_url(temp.img_response.url, name, False)
-                width, height = chat_images.chat_images.pil_image[name]["resized-600"].size
+                width, height = image_size(name, "resized-600")
                 return f'<img src="{chat_images.chat_images.get_file_url(name)}" alt="{name}" width="{width}" height="{height}"/>'
             else:
                 return m.group()
 
-    def insert_latex(latex_, idx_, inverted) -> Tuple[str, str]:
-        name = hashlib.md5(latex_[0:124].encode()).hexdigest()
-        if chat_images.chat_images.get(name) and chat_images.chat_images.get(name) != "broken":
-            return f'<img src="{chat_images.chat_images.get_file_url(name, inverted)}" alt="{name}"/>', idx_
-        elif chat_images.chat_images.get(name) != "broken":
+    def insert_latex(latex_, inverted) -> str:
+        name = content_key(latex_)
+        # rendered images are persisted in the chat_images store, so they survive application restart
+        cached = chat_images.chat_images.get(name)
+        if cached == "broken":
+            return latex_
+        if not cached:
             ret = latex_to_image(latex_)
-            if ret.get("imageUrl"):
-                # ImageTk must be False, as ImageTk.PhotoImage is not thread-safely
-                name = chat_images.chat_images.create_from_url(ret.get("imageUrl"), name, False)
-                return f'<img src="{chat_images.chat_images.get_file_url(name, inverted)}" alt="{name}"/>', idx_
-            else:
+            if not ret.get("imageUrl"):
                 # mark the image as broken, so it will not be process next time
                 chat_images.chat_images[name] = "broken"
-                return latex_, idx_
-        else:
-            return latex_, idx_
+                return latex_
+            # ImageTk must be False, as ImageTk.PhotoImage is not thread-safely
+            name = chat_images.chat_images.create_from_url(ret.get("imageUrl"), name, False)
+        return f'<img src="{chat_images.chat_images.get_file_url(name, inverted)}" alt="{name}"/>'
+
+    mermaid_map = {}
 
-    text_no_code, code_map = replace_text(MERMAID_RE.sub(insert_mermaid, text), [r"```[\s\S]*?```", r"`[^`]+`"])
+    def replace_mermaid(m: re.Match) -> str:
+        placeholder = f"__\xd7_mmd_{len(mermaid_map)}__"
+        mermaid_map[placeholder] = m
+        return placeholder
+
+    # mermaid graphs and latex are rendered together in the background, the placeholders are restored at the end
+    if "```" in text and ("mermaid" in text or "mmd" in text):
+        # mermaid package is imported only when the first graph is rendered
+        text = MERMAID_RE.sub(replace_mermaid, text)
+    text_no_code, code_map = replace_code_blocks(text)
+    futures = {
+        _RENDER_POOL.submit(insert_mermaid, m): (mermaid_map, placeholder) for placeholder, m in mermaid_map.items()
+    }
 
     text_no_latex, latex_map = replace_latex(text_no_code)
     if latex_map:
@@ -221,30 +372,33 @@ def to_md(text: str, col: str = None) -> str:
             # On Windows we've got SystemWindowText color which is not know by Pillow
             # it hapens on build in light themes
             inverted = False
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for idx, latex in {k: v for k, v in latex_map.items()}.items():
-                futures.append(executor.submit(insert_latex, latex, idx, inverted))
-            for future in as_completed(futures):
-                try:
-                    ret = future.result()
-                    latex_map[ret[1]] = ret[0]
-                except Exception as e:
-                    raise e
-
-    text = restore_text(
-        IMAGE_MARKDOWN_RE.sub(
-            insert_img_wh,
-            IMAGE_DATA_URL_MARKDOWN_RE.sub(insert_img, restore_text(text_no_latex, latex_map)),
-        ),
-        code_map,
-    )
+        for idx, latex in latex_map.items():
+            futures[_RENDER_POOL.submit(insert_latex, latex, inverted)] = (latex_map, idx)
+    for future in as_completed(futures):
+        map_, placeholder = futures[future]
+        map_[placeholder] = future.result()
+
+    text = restore_text(text_no_latex, latex_map)
+    if "![" in text:
+        text = IMAGE_ANY_MARKDOWN_RE.sub(insert_img, text)
+    text = restore_text(text, code_map | mermaid_map)
+
+    html = MARKDOWN.render(text)
+    return f'<span style="color:{col}">{html}</span>' if col else html
 
-    html = markdown2.markdown(
-        text,
-        extras=["tables", "fenced-code-blocks", "cuddled-lists", "code-friendly"],
+
+@lru_cache(maxsize=16)
+def separators(col: str) -> Tuple[str, str]:
+    """
+    Return HTML horizontal line separators for human and AI messages in given color.
+
+    :param col: The color of separators.
+    :return: human separator, AI separator
+    """
+    return (
+        f'\n\n<hr style="height:2px;border-width:0;color:{col};background-color:{col}">\n',
+        f'\n\n<hr style="height:4px;border-width:0;color:{col};background-color:{col}">',
     )
-    return f'<span style="color:{col}">{html}</span>' if col else html
 
 
 @lru_cache(maxsize=256)
@@ -261,12 +415,7 @@ def prepare_message(text: str, tag: str, col: str, sep=True) -> Tuple[str, str]:
     :param sep: Add separators or not.
     :return: The formatted message as a string.
     """
-    if sep:
-        sep_human = f'\n\n<hr style="height:2px;border-width:0;color:{col};background-color:{col}">\n'
-        sep_ai = f'\n\n<hr style="height:4px;border-width:0;color:{col};background-color:{col}">'
-    else:
-        sep_human = ""
-        sep_ai = ""
+    sep_human, sep_ai = separators(col) if sep else ("", "")
     text = str_shortening(text) if tag == "TOOL" else text
     if tag == "HUMAN":
         m_text = text.strip() + sep_human
@@ -274,7 +423,7 @@ def prepare_message(text: str, tag: str, col: str, sep=True) -> Tuple[str, str]:
         m_text = text
     else:
         m_text = text
-        if len([index for index in range(len(text)) if text.startswith("```", index)]) % 2 == 1:
+        if text.count("```") & 1:
             # situation when LLM give text block in ``` but the ``` are unbalanced
             # it can happen when completion tokens where not enough
             m_text += "\n\n```"
@@ -283,7 +432,12 @@ def prepare_message(text: str, tag: str, col: str, sep=True) -> Tuple[str, str]:
     return m_text, col
 
 
-def find_lands(type: str, build_in: Path) -> List[Path]:
+_LANDS_ROOT = (Path(__file__).parent / "..").resolve()
+"""krAIna root folder, the lands are its subfolders"""
+
+
+@lru_cache(maxsize=None)
+def find_lands(type: str, build_in: Path) -> Tuple[Path, ...]:
     """
     Generate a list of all available assistants/snippets/tools.
 
@@ -291,18 +445,57 @@ def find_lands(type: str, build_in: Path) -> List[Path]:
     If the `.kraina-land` label file is inside such a subfolder,
     the folder is a Kraina add-in and is scanned for types.
 
+    The lands layout is static, so the result is cached. Use `find_lands.cache_clear()` to scan again.
+
     :param type: one of the beings as string: assistants, snippets, tools
     :param build_in: Path to build in a set of being type
     :return:
     """
     set_ = [build_in]
-    for land in (Path(__file__).parent / "..").glob("*"):
-        if not (land.is_dir() or land.name.startswith(".")):
-            continue
-        enabler = land / ".kraina-land"
-        if enabler.exists() and (land / type).exists():
-            set_.append(land / type)
-    return set_
+    # DirEntry caches the file type, so no additional stat per entry is needed to filter out files
+    with os.scandir(_LANDS_ROOT) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            land = Path(entry.path)
+            if (land / ".kraina-land").exists() and (land / type).exists():
+                set_.append(land / type)
+    # immutable, the result is shared by all callers
+    return tuple(set_)
+
+
+def _read_being(folder: Path) -> Tuple[Path, Union[str, None], Union[str, None]]:
+    """
+    Read the being files from folder.
+
+    :param folder: being folder
+    :return: folder, prompt.md content or None if not exists, config.yaml content or None if not exists
+    """
+    try:
+        prompt = (folder / "prompt.md").read_text()
+    except FileNotFoundError:
+        return folder, None, None
+    try:
+        config = (folder / "config.yaml").read_text()
+    except FileNotFoundError:
+        config = None
+    return folder, prompt, config
+
+
+def read_beings(beings_set: Path) -> List[Tuple[Path, Union[str, None], Union[str, None]]]:
+    """
+    Read `prompt.md` and `config.yaml` files of all assistants/snippets folders in the set.
+
+    The files are read in parallel, the result is sorted by folder name.
+
+    :param beings_set: folder with assistants/snippets folders, one of the `find_lands()` results
+    :return: List of (folder, prompt.md content or None if not being folder, config.yaml content or None)
+    """
+    # DirEntry caches the file type, so no additional stat per entry is needed to filter out files
+    with os.scandir(beings_set) as it:
+        folders = sorted(Path(entry.path) for entry in it if entry.is_dir())
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="beings") as pool:
+        return list(pool.map(_read_being, folders))
 
 
 import inspect
@@ -315,18 +508,32 @@ def get_func_args(func) -> Dict:
     This function returns a dictionary where the keys are argument names
     and the values are their default values as strings, or None if no default.
 
+    The result is stored on the function object as immutable tuple of (name, default) pairs,
+    so the signature is inspected only once and each caller gets its own dictionary.
+    Bound methods store it on the underlying function, separately as their signature has no `self`.
+
     :param func: The function to inspect.
     :return: A dictionary with argument names and their default values.
     """
+    target = getattr(func, "__func__", func)
+    attr = "_kraina_args" if target is func else "_kraina_bound_args"
+    cached = getattr(target, attr, None)
+    if cached is not None:
+        return dict(cached)
     signature = inspect.signature(func)
-    ret = {}
-    for k, v in signature.parameters.items():
-        annot = v.annotation.__name__.replace("_empty", "Any")
-        if v.default is not inspect.Parameter.empty:
-            ret[f"{k}({annot})"] = str(v.default)
-        else:
-            ret[f"{k}({annot})"] = None
-    return ret
+    ret = tuple(
+        (
+            f"{k}({v.annotation.__name__.replace('_empty', 'Any')})",
+            str(v.default) if v.default is not inspect.Parameter.empty else None,
+        )
+        for k, v in signature.parameters.items()
+    )
+    try:
+        setattr(target, attr, ret)
+    except (AttributeError, TypeError):
+        # builtins don't accept new attributes
+        pass
+    return dict(ret)
 
 
 def find_hyperlinks(text: str, no_hyper_tag: str = "") -> list:
@@ -340,38 +547,37 @@ def find_hyperlinks(text: str, no_hyper_tag: str = "") -> list:
     :param no_hyper_tag: Tag to use for non-hyperlinked text sections.
     :return: A list with parts of the text tagged as hyperlinks or non-hyperlinked text.
     """
-    # Regular expressions for URL and file paths
-    url_regex = re.compile(r"(https?://[^\s)\",'`]+)")
-    posix_path_regex = re.compile(r"(/[^)\s]+\.[^)\s\",'`]+)")
-    windows_path_regex = re.compile(r"([a-zA-Z]:\\[^)\",'`\s]+)")
-
-    # Combine all regex patterns
-    combined_regex = re.compile(f"{url_regex.pattern}|{posix_path_regex.pattern}|{windows_path_regex.pattern}")
-
-    # Find all matches in the text
-    matches = combined_regex.finditer(text)
-
+    hyper_tag = ["hyper", no_hyper_tag]
     parts = []
-    last_index = 0
-
-    for match in matches:
-        match_str = match.group(0)
-        start_index = match.start()
-
-        if last_index < start_index:
-            parts.append(text[last_index:start_index])
-            parts.append(no_hyper_tag)  # Add empty tag for no hyper text
-
-        parts.append(match_str)
-        parts.append(["hyper", no_hyper_tag])
+    for idx, token in enumerate(HYPERLINK_RE.split(text)):
+        if token:
+            parts.append(token)
+            parts.append(hyper_tag if idx & 1 else no_hyper_tag)
+    return parts
 
-        last_index = match.end()
 
-    if last_index < len(text):
-        parts.append(text[last_index:])
-        parts.append(no_hyper_tag)  # Add empty tag for no hyper text
+@lru_cache(maxsize=1)
+def _linux_clipboard_args() -> Tuple[str, ...]:
+    """
+    Select the Linux clipboard backend, once per process.
 
-    return parts
+    :return: command to read image from clipboard
+    :raises NotImplementedError: If neither wl-paste nor xclip is available
+    """
+    if os.getenv("WAYLAND_DISPLAY"):
+        session_type = "wayland"
+    elif os.getenv("DISPLAY"):
+        session_type = "x11"
+    else:  # Session type check failed
+        session_type = None
+
+    if shutil.which("wl-paste") and session_type in ("wayland", None):
+        return "wl-paste", "-t", "image"
+    elif shutil.which("xclip") and session_type in ("x11", None):
+        return "xclip", "-selection", "clipboard", "-t", "image/png", "-o"
+    else:
+        msg = "wl-paste or xclip is required for ImageGrab.grabclipboard() on Linux"
+        raise NotImplementedError(msg)
 
 
 def grabclipboard():
@@ -420,23 +626,10 @@ def grabclipboard():
                 return BmpImagePlugin.DibImageFile(data)
         return None
     else:
-        if os.getenv("WAYLAND_DISPLAY"):
-            session_type = "wayland"
-        elif os.getenv("DISPLAY"):
-            session_type = "x11"
-        else:  # Session type check failed
-            session_type = None
-
-        if shutil.which("wl-paste") and session_type in ("wayland", None):
-            args = ["wl-paste", "-t", "image"]
-        elif shutil.which("xclip") and session_type in ("x11", None):
-            args = ["xclip", "-selection", "clipboard", "-t", "image/png", "-o"]
-        else:
-            msg = "wl-paste or xclip is required for ImageGrab.grabclipboard() on Linux"
-            raise NotImplementedError(msg)
+        args = _linux_clipboard_args()
         try:
-            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-            stdout, stderr = p.communicate(timeout=0.5)
+            p = subprocess.run(args, check=False, capture_output=True, timeout=0.5)
+            stdout, stderr = p.stdout, p.stderr
         except subprocess.TimeoutExpired:
             stderr = b"cannot convert "
         if stderr:
@@ -467,6 +660,18 @@ def grabclipboard():
         return im
 
 
+_clipboard_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clipboard")
+
+
+def grabclipboard_async() -> Future:
+    """
+    Grab the clipboard image in background thread, to not block GUI while the image is read and decoded.
+
+    :return: Future with the `grabclipboard()` result
+    """
+    return _clipboard_pool.submit(grabclipboard)
+
+
 def _convert_data_url_to_file_url(m: re.Match) -> str:
     """
     Convert Markdown data URL image into a file image.
@@ -493,20 +698,26 @@ def convert_llm_response(msg: str):
     :param msg: Message which includes Markdown data URL images
     :return: converted message
     """
+    if "data:image/" not in msg:
+        return msg
+    return IMAGE_DATA_URL_MARKDOWN_RE.sub(_convert_data_url_to_file_url, msg)
 
-    def _convert(m):
-        name = chat_images.chat_images.create_from_url(m.group("img_data"), m.group("img_name"), False)
-        return f'![{m.group("img_name")}]({chat_images.chat_images.get_file_uri(name)})'
 
-    return IMAGE_DATA_URL_MARKDOWN_RE.sub(_convert, msg)
+def _convert_user_image(m: re.Match) -> str:
+    """
+    Convert Markdown image from URL into a file image named `img-<name>`.
 
+    :param m: A regex match object containing groups 'img_url' and 'img_name'.
+    :return: A Markdown image reference pointing to the created file.
+    """
+    name = chat_images.chat_images.create_from_url(m.group("img_url"), "img-" + m.group("img_name"), False)
+    return f'![{"img-" + m.group("img_name")}]({chat_images.chat_images.get_file_url(name)})'
 
-def convert_user_query(msg: str):
-    def _convert(m):
-        name = chat_images.chat_images.create_from_url(m.group("img_url"), "img-" + m.group("img_name"), False)
-        return f'![{"img-" + m.group("img_name")}]({chat_images.chat_images.get_file_url(name)})'
 
-    return IMAGE_MARKDOWN_RE.sub(_convert, msg)
+def convert_user_query(msg: str):
+    if "](https://" not in msg and "](file://" not in msg:
+        return msg
+    return IMAGE_MARKDOWN_RE.sub(_convert_user_image, msg)
 
 
 def kraina_db(new_db: str = None) -> str:
@@ -515,23 +726,25 @@ def kraina_db(new_db: str = None) -> str:
 
     If a new database name is provided, it sets the environment variable "KRAINA_DB"
     to this new name. It then returns the absolute path to the Kraina database file.
+    The environment variable is read on every call, config.yaml is read only when the variable is not set.
 
     :param new_db: Optional; The new database name to set in the environment variable.
     :return: The absolute path to the Kraina database file.
     """
-    if os.environ.get("KRAINA_DB", None) is None:
+    root = Path(__file__).parent / "../"
+    if new_db:
+        os.environ["KRAINA_DB"] = str((root / new_db).resolve())
+    elif os.environ.get("KRAINA_DB", None) is None:
         db_settings = {}
-        if (Path(__file__).parent / "../config.yaml").resolve().exists():
-            with open((Path(__file__).parent / "../config.yaml").resolve(), "r") as f:
-                data = yaml.load(f, Loader=yaml.SafeLoader)
+        if (config := (root / "config.yaml").resolve()).exists():
+            with open(config, "r") as f:
+                data = yaml.load(f, Loader=SafeLoader)
                 db_settings = data.get("db", {})
         if db_settings.get("database", None):
-            os.environ["KRAINA_DB"] = str((Path(__file__).parent / "../" / db_settings["database"]).resolve())
+            os.environ["KRAINA_DB"] = str((root / db_settings["database"]).resolve())
         else:
-            os.environ["KRAINA_DB"] = str((Path(__file__).parent / "../" / "kraina.db").resolve())
-    if new_db:
-        os.environ["KRAINA_DB"] = str((Path(__file__).parent / "../" / new_db).resolve())
-    return os.environ.get("KRAINA_DB")
+            os.environ["KRAINA_DB"] = str((root / "kraina.db").resolve())
+    return os.environ["KRAINA_DB"]
 
 
 def latex_to_image(latex_input=None, output_format="PNG", output_scale="100%"):
@@ -567,7 +780,7 @@ def latex_to_image(latex_input=None, output_format="PNG", output_scale="100%"):
 
     try:
         # Make the POST request
-        response = requests.post(url, headers=headers, json=payload)
+        response = _LATEX_SESSION.post(url, headers=headers, json=payload, timeout=10)
 
         # Raise an exception for bad status codes
         response.raise_for_status()
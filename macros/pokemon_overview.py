@@ -20,20 +20,23 @@ Here is an example of macro which:
    - Retrieve the "echo" assistant from `Assistants`.
    - Set the assistant's `max_tokens` to 2048 and `model` to "gpt-4o-mini" - to show that it's possible
 
-4. **Interact with Chat Interface**:
-   - Run an initial query to describe Pokemons.
+4. **Gather Information**:
+   - Ask in one batched query to describe Pokemons and for markdown tables of Pokemon types, the strongest,
+     and the weakest Pokemons. The questions are independent, so one call saves the round trips
+     and does not re-send the same system prompt and context for every question.
+   - Ask separately only for answers missing in the batched response.
+
+5. **Interact with Chat Interface**:
    - Reload and select the chat based on the response conversation ID.
    - Display the chat in chat application.
 
-5. **Gather Information**:
-   - Request markdown tables of Pokemon types, the strongest, and the weakest Pokemons, each followed by selecting the respective chat.
-
 6. **Document Preparation**:
    - Request the assistant to generate an outline for the document.
    - Instruct the assistant to generate the document in chunks, specifying that each chunk should be no longer than 2048 tokens and in markdown format.
 
 7. * Generation Loop**:
    - Continuously request chunks until the `__DONE__` marker is found.
+   - Refresh the chat in background, so the next chunk is requested without waiting for the Chat app.
    - Clean and collect each chunk.
 
 8. **File Writing**:
@@ -46,14 +49,40 @@ Here is an example of macro which:
     - Return the absolute path of the generated file.
 """
 import logging
+import re
 import sys
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Tuple
 
 from dotenv import load_dotenv, find_dotenv
+from assistants.assistant import AssistantResp
 from assistants.base import Assistants
 from chat.cli import ChatInterface
 
+BATCH_HEADER_RE = re.compile(r"^## \[(\d+)\]", re.MULTILINE)
+
+
+def batched_run(llm, prompts: List[str], conv_id: int = None) -> Tuple[AssistantResp, Dict[int, str]]:
+    """
+    Ask the assistant several independent questions in one query.
+
+    The questions are indexed and the assistant is asked to answer each of them under `## [index]` header.
+
+    :param llm: Assistant to query
+    :param prompts: List of questions
+    :param conv_id: Conversation ID. If None, new conversation is started
+    :return: Tuple of assistant response and answers found in the response, index: answer
+    """
+    query = "Answer each question below under its own markdown header `## [index]`, e.g. `## [1]`\n"
+    query += "\n".join(f"[{idx}] {prompt}" for idx, prompt in enumerate(prompts, 1))
+    resp = llm.run(query, conv_id=conv_id)
+    # [text before first header, index, answer, index, answer, ...]
+    parts = BATCH_HEADER_RE.split(resp.content)
+    answers = {int(idx): answer.strip() for idx, answer in zip(parts[1::2], parts[2::2])}
+    return resp, answers
+
 
 def run(out_file: str, doc_type: str = "HTML") -> str:
     """
@@ -79,17 +108,22 @@ def run(out_file: str, doc_type: str = "HTML") -> str:
     llm.max_tokens = 2048
     llm.model = "gpt-4o-mini"
 
-    llm_resp = llm.run("Describe what are the Pokemons")
+    prompts = [
+        "Describe what are the Pokemons",
+        "Give me All types of pokemons in markdown table with pros and cons of each type",
+        "Give me 5 the strongest pokemons in markdown table with type and powers",
+        "Give me 5 the weakest pokemons in markdown table with type and powers",
+    ]
+    llm_resp, answers = batched_run(llm, prompts)
     chat("RELOAD_CHAT_LIST")  #
     chat("SELECT_CHAT", llm_resp.conv_id)
     chat("SHOW_APP")
 
-    llm.run("Give me All types of pokemons in markdown table with pros and cons of each type", conv_id=llm_resp.conv_id)
-    chat("SELECT_CHAT", llm_resp.conv_id)
-    llm.run("Give me 5 the strongest pokemons in markdown table with type and powers", conv_id=llm_resp.conv_id)
-    chat("SELECT_CHAT", llm_resp.conv_id)
-    llm.run("Give me 5 the weakest pokemons in markdown table with type and powers", conv_id=llm_resp.conv_id)
-    chat("SELECT_CHAT", llm_resp.conv_id)
+    for idx, prompt in enumerate(prompts, 1):
+        if not answers.get(idx):
+            # not answered in batched response, ask again
+            llm.run(prompt, conv_id=llm_resp.conv_id)
+            chat("SELECT_CHAT", llm_resp.conv_id)
 
     llm.run(
         """
@@ -118,28 +152,39 @@ def run(out_file: str, doc_type: str = "HTML") -> str:
 
     html = []
     done = False
-    while not done:
-        chunk = llm.run(f"Generate next chunk of {doc_type} code", conv_id=llm_resp.conv_id)
-        chat("SELECT_CHAT", llm_resp.conv_id)
-        # clean the received content
-        content = chunk.content.replace("__DONE__", "").strip().split("\n")
-        if "```" in content[0]:
-            content.pop(0)
-        if "```" in content[-1]:
-            content.pop(-1)
-        html.append("\n".join(content))
-        if "__DONE__" in chunk.content:
-            done = True
-
-    with open(Path(out_file), "w") as fd:
+    # Each chunk depends on the previous ones, so only the Chat app refresh can run alongside the next LLM query.
+    # One worker keeps the refreshes in order.
+    refresh = None
+    with ThreadPoolExecutor(max_workers=1) as chat_pool:
+        while not done:
+            chunk = llm.run(f"Generate next chunk of {doc_type} code", conv_id=llm_resp.conv_id)
+            if refresh:
+                # raise the error of the previous refresh, it must not be lost in the pool
+                refresh.result()
+            refresh = chat_pool.submit(chat, "SELECT_CHAT", llm_resp.conv_id)
+            # clean the received content, the marker may be followed by code block end, so look for it everywhere
+            content = chunk.content
+            done = "__DONE__" in content
+            if done:
+                content = content.replace("__DONE__", "")
+            content = content.strip().split("\n")
+            if "```" in content[0]:
+                content.pop(0)
+            if "```" in content[-1]:
+                content.pop(-1)
+            html.append("\n".join(content))
+        refresh.result()
+
+    out_path = Path(out_file).resolve()
+    with open(out_path, "w") as fd:
         fd.write("\n".join(html))
     # write into the chat link to file - you can open the link from chat app later on
     llm.run(
-        f"link to document: [{Path(out_file).stem}]({Path(out_file).resolve()}). Do nothing with it, just notice this.",
+        f"link to document: [{out_path.stem}]({out_path}). Do nothing with it, just notice this.",
         conv_id=llm_resp.conv_id,
     )
     chat("SELECT_CHAT", llm_resp.conv_id)
-    return f"'{Path(out_file).resolve()}' generated"
+    return f"'{out_path}' generated"
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
 import argparse
+import os
+import shutil
 import sys
 
 import yaml
 from typing import Dict, Any, Set, Optional
 
+try:
+    # libyaml based loader and dumper are much faster, but they're optional in PyYAML
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
 
 def merge_yaml_files(
     primary_file: str, secondary_file: str, overwrite_keys: Optional[Set[str]] = None
@@ -23,18 +31,25 @@ def merge_yaml_files(
     :raises FileNotFoundError: If either of the YAML files cannot be found.
     """
 
-    def deep_merge(dict1: Dict, dict2: Dict, current_path: str = "") -> Dict:
+    # Trie of overwritable keys, e.g. {"server": {"host": {None: True}}}. None key marks the overwritable path
+    overwrite_trie: Dict = {}
+    for overwrite_key in overwrite_keys or ():
+        node = overwrite_trie
+        for part in overwrite_key.split("."):
+            node = node.setdefault(part, {})
+        node[None] = True
+
+    def deep_merge(dict1: Dict, dict2: Dict, trie_node: Dict) -> Dict:
         """
         Recursively merge two dictionaries, preserving keys from dict1 except for overwritable keys.
         """
         merged = dict1.copy()
         for key, value in dict2.items():
-            path = f"{current_path}.{key}".lstrip(".")
             if key not in merged:
                 merged[key] = value
             elif isinstance(merged[key], dict) and isinstance(value, dict):
-                merged[key] = deep_merge(merged[key], value, path)
-            elif overwrite_keys is not None and path in overwrite_keys:
+                merged[key] = deep_merge(merged[key], value, trie_node.get(str(key), {}))
+            elif None in trie_node.get(str(key), {}):
                 merged[key] = value
 
         return merged
@@ -42,18 +57,28 @@ def merge_yaml_files(
     try:
         # Read primary YAML file
         with open(primary_file, "r") as f1:
-            yaml1 = yaml.safe_load(f1) or {}
+            yaml1 = yaml.load(f1, Loader=SafeLoader) or {}
 
         # Read secondary YAML file
         with open(secondary_file, "r") as f2:
-            yaml2 = yaml.safe_load(f2) or {}
+            yaml2 = yaml.load(f2, Loader=SafeLoader) or {}
 
         # Merge the YAML contents
-        merged_yaml = deep_merge(yaml1, yaml2)
-
-        # Write back to primary file
-        with open(primary_file, "w") as f:
-            yaml.dump(merged_yaml, f, default_flow_style=False, sort_keys=False)
+        merged_yaml = deep_merge(yaml1, yaml2, overwrite_trie)
+
+        # Write back to primary file atomically, interrupted write must not leave the primary file truncated
+        tmp_file = primary_file + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                yaml.dump(merged_yaml, f, Dumper=SafeDumper, default_flow_style=False, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            shutil.copymode(primary_file, tmp_file)
+            os.replace(tmp_file, primary_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+            raise
 
         return merged_yaml
 
@@ -97,7 +122,7 @@ Examples:
         if overwrite_keys:
             print(f"Allowed overwrites: {overwrite_keys}")
         print("\nMerged content:")
-        print(yaml.dump(merged, default_flow_style=False, sort_keys=False))
+        print(yaml.dump(merged, Dumper=SafeDumper, default_flow_style=False, sort_keys=False))
 
         sys.exit(0)
 
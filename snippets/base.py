@@ -7,7 +7,7 @@ from typing import Dict
 import yaml
 from dotenv import load_dotenv, find_dotenv
 
-from libs.utils import import_module, find_lands
+from libs.utils import import_module, find_lands, read_beings, SafeLoader
 from snippets.snippet import BaseSnippet
 
 logger = logging.getLogger(__name__)
@@ -31,19 +31,17 @@ class Snippets(Dict[str, BaseSnippet]):
         snippet_sets = find_lands("snippets", Path(__file__).parent)
 
         for snippet_set in snippet_sets:
-            for snippet in snippet_set.glob("*"):
+            for snippet, prompt, config in read_beings(snippet_set):
                 if self.get(snippet.name) is not None:
                     logger.error(f"'{snippet.name}` snippet already exist")
                     continue
-                if not (snippet.is_dir() and (snippet / "prompt.md").exists()):
+                if prompt is None:
                     logger.debug(f"This is not snippet folder:{snippet}")
                     continue
-                prompt = (snippet / "prompt.md").read_text()
                 snippet_cls = BaseSnippet
                 settings = {}
-                if (snippet / "config.yaml").exists():
-                    with open(snippet / "config.yaml") as fd:
-                        settings = yaml.safe_load(fd.read())
+                if config is not None:
+                    settings = yaml.load(config, Loader=SafeLoader)
                     contexts = []
                     if settings.get("contexts", None):
                         for name, context in settings["contexts"].items():
@@ -68,9 +66,7 @@ class Snippets(Dict[str, BaseSnippet]):
                     contexts.append("Current date: {date}")
                     settings["contexts"] = contexts
                     prompt += "\nTake into consideration the context below while generating answers.\n# Context:"
-                    for idx, context in enumerate(contexts):
-                        prompt += f"\n## {idx}"
-                        prompt += "\n" + context
+                    prompt += "".join(f"\n## {idx}\n{context}" for idx, context in enumerate(contexts))
 
                     if settings.get("model", None):
                         settings["_model"] = settings.pop("model")
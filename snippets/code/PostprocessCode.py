@@ -18,16 +18,18 @@ class PostprocessCode(BaseSnippet):
         :param code: A string representing the code to analyze.
         :return: The number of leading spaces in the first non-empty line.
         """
-        if not code:
-            return 0
-
-        lines = code.splitlines()
-        # Find the first non-empty line
-        for line in lines:
+        start = 0
+        # Find the first non-empty line, without splitting the whole code into lines
+        while start < len(code):
+            end = code.find("\n", start)
+            if end == -1:
+                end = len(code)
+            line = code[start:end]
             if line.strip():  # Non-empty line
                 line = line.replace("\t", " " * 4)
                 indent_level = len(line) - len(line.lstrip())
                 return indent_level
+            start = end + 1
         return 0
 
     def indent_code(self, lines: List[str], indent_level: int) -> str:
@@ -41,33 +43,78 @@ class PostprocessCode(BaseSnippet):
         """
         if not lines:
             return ""
-        # Join the lines back into a single string
-        indented_code = "\n".join([(" " * indent_level) + line for line in lines])
-        return indented_code
+        if indent_level == 0:
+            return "\n".join(lines)
+        # Join the lines back into a single string, the indent is a part of separator, no line is copied to add it
+        prefix = " " * indent_level
+        return prefix + ("\n" + prefix).join(lines)
+
+    @staticmethod
+    def _review_query(query: str) -> str:
+        """
+        Add the code review request to the query, the generation and review is done in one LLM call.
+
+        :param query: The input query containing a programmer task.
+        :return: The query with code review request.
+        """
+        return query + (
+            "\n\nBefore you answer, review your code and make corrections. "
+            "Return only the final code without any explanation, examples or test.\n"
+            "Return as Markdown code."
+        )
+
+    def _postprocess(self, ret: str, indent_level: int) -> str:
+        """
+        Remove Markdown code block markers and indent the code.
+
+        :param ret: LLM response
+        :param indent_level: Number of spaces to indent each line.
+        :return: Corrected code with the original indentation.
+        """
+        # Work on the raw string, the response is never split into the list of lines.
+        # Line breaks are normalised and the trailing one does not open a new line, the same as in splitlines()
+        if "\r" in ret:
+            ret = ret.replace("\r\n", "\n").replace("\r", "\n")
+        code = ret[:-1] if ret.endswith("\n") else ret
+        if "```" in code:
+            first_end = code.find("\n")
+            if "```" in code[: first_end if first_end != -1 else None]:
+                code = code[first_end + 1 :] if first_end != -1 else ""
+            last_start = code.rfind("\n")
+            if "```" in code[last_start + 1 :]:
+                code = code[:last_start] if last_start != -1 else ""
+        if not code or indent_level == 0:
+            return code
+        prefix = " " * indent_level
+        return prefix + code.replace("\n", "\n" + prefix)
 
     def run(self, query: str, /, **kwargs) -> str:
         """
         Process a query and return corrected code with appropriate indentation.
 
-        This function takes a query, processes it to correct the code within,
+        This function takes a query, asks LLM to generate and self-review the code in one request,
         and returns the corrected code with the original indentation level.
 
         :param query: The input query containing a programmer task.
         :param kwargs: Additional keyword arguments for the processing.
         :return: Corrected code with the original indentation.
         """
+        if not query.strip():
+            return ""
         indent_level = self.calculate_indent(query)
-        ret = super().run(query, **kwargs)
-        query = f"""
-        Here is the code with explanation:
-        ```
-        {ret}
-        ```
-        Review the code above, make corrections and return only the code without any examples or test.
-        Return as Markdown code.
+        ret = super().run(self._review_query(query), **kwargs)
+        return self._postprocess(ret, indent_level)
+
+    async def arun(self, query: str, /, **kwargs) -> str:
+        """
+        Async version of `run()`.
+
+        :param query: The input query containing a programmer task.
+        :param kwargs: Additional keyword arguments for the processing.
+        :return: Corrected code with the original indentation.
         """
-        ret = super().run(query, **kwargs)
-        s_ret = ret.splitlines()
-        id_start = 1 if "```" in s_ret[0] else 0
-        id_stop = -1 if "```" in s_ret[-1] else None
-        return self.indent_code(s_ret[id_start:id_stop], indent_level)
+        if not query.strip():
+            return ""
+        indent_level = self.calculate_indent(query)
+        ret = await super().arun(self._review_query(query), **kwargs)
+        return self._postprocess(ret, indent_level)
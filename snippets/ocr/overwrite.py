@@ -1,6 +1,9 @@
 """Specialisation for response skill."""
 import base64
 import logging
+import mimetypes
+import mmap
+import os
 from pathlib import Path
 from langchain_core.messages import HumanMessage
 
@@ -10,6 +13,22 @@ from snippets.snippet import BaseSnippet
 logger = logging.getLogger(__name__)
 
 
+def _encode_image(path: Path) -> str:
+    """
+    Encode the image file into base64.
+
+    :param path: image file path
+    :return: base64 encoded image
+    """
+    with open(path, "rb") as image_file:
+        if os.fstat(image_file.fileno()).st_size == 0:
+            # empty file cannot be mapped
+            return ""
+        # encode straight from the mapped file, without a copy of the whole file in memory
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode("ascii")
+
+
 class Response(BaseSnippet):
     """
     Overwritten BaseSkill class to customize run method.
@@ -27,17 +46,18 @@ class Response(BaseSnippet):
         if not (Path(query).is_file() and Path(query).exists()):
             raise FileNotFoundError(query)
 
-        with open(Path(query), "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        base64_image = _encode_image(Path(query))
+        mime_type = mimetypes.guess_type(query)[0]
+        if not (mime_type and mime_type.startswith("image/")):
+            mime_type = "image/png"
 
-        chat = chat_llm(
-            model=self.model, temperature=self.temperature, max_tokens=self.max_tokens
-        )
+        # not cached on disk, the whole base64 image would be a part of the cache key
+        chat = chat_llm(model=self.model, temperature=self.temperature, max_tokens=self.max_tokens)
         content = [
             {"type": "text", "text": self.prompt},
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{base64_image}"},
+                "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
             },
         ]
         ret = chat.invoke([HumanMessage(content=content)])
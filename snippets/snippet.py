@@ -1,24 +1,62 @@
 """Base snippet class."""
 
+import asyncio
+import hashlib
 import logging
-from dataclasses import dataclass
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Union, List, Type
+from typing import AsyncIterator, Dict, Iterator, List, Tuple, Type, Union
 
-from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 from pydantic import BaseModel
 
 from libs.langfuse import langfuse_handler
-from libs.llm import chat_llm, map_model
+from libs.llm import OVERWRITE_LLM_SETTINGS, SemanticCache, chat_llm, get_llm_type, map_model, semantic_cache
 
 logger = logging.getLogger(__name__)
 
 SPECIALIZED_SNIPPETS = {}
 
+STOP_REASONS = frozenset({"stop", "end_turn", "stop_sequence"})
+"""Finish reasons of complete LLM response"""
+
+
+def _finish_reason(message: BaseMessage) -> str:
+    """
+    Get the reason why LLM finished the response.
+
+    :param message: LLM response
+    :return: finish reason
+    :raises KeyError: If none of the known finish reason keys is in the response metadata
+    """
+    for reason in ("finish_reason", "stop_reason", "done_reason"):
+        if reason in message.response_metadata:
+            return message.response_metadata[reason]
+    raise KeyError("finish_reason")
+
+
+@lru_cache(maxsize=64)
+def _snippet_template(system_role: str, prompt: str) -> ChatPromptTemplate:
+    """
+    Create the snippet prompt template, once per system prompt.
+
+    :param system_role: role of the system prompt message, system or human for reasoning models
+    :param prompt: snippet system prompt
+    :return: prompt template, shared by all calls, do not modify it
+    """
+    return ChatPromptTemplate.from_messages(
+        [
+            (system_role, prompt),
+            ("human", "{text}"),
+        ]
+    )
+
 
 @dataclass(eq=False)
 class BaseSnippet:
@@ -46,6 +84,12 @@ class BaseSnippet:
     """Force LLM to output in json_object format"""
     pydantic_output: Type[BaseModel] = None
     """Serialize JSON output into Pydantic model. The best is to use with json_mode"""
+    cache_semantic: bool = False
+    """Return cached response of similar query. Used only when temperature is not 0 and no kwargs are passed"""
+    semantic_threshold: float = 0.92
+    """Minimal similarity of the queries to return cached response"""
+    last_usage: Dict = field(default=None, init=False, repr=False)
+    """Token usage and duration of the last LLM request, not reliable when the snippet is run concurrently"""
 
     def __init_subclass__(cls, **kwargs):
         """
@@ -55,6 +99,13 @@ class BaseSnippet:
         """
         super().__init_subclass__(**kwargs)
         if not cls.__name__.startswith("_"):
+            registered = SPECIALIZED_SNIPPETS.get(cls.__name__)
+            if registered is not None and registered.__module__ != cls.__module__:
+                # the same module reloaded after modification is fine, the class from other module overwrites it
+                logger.warning(
+                    f"'{cls.__name__}' snippet class from '{cls.__module__}' overwrites the one from "
+                    f"'{registered.__module__}'"
+                )
             SPECIALIZED_SNIPPETS[cls.__name__] = cls
 
     @property
@@ -77,41 +128,155 @@ class BaseSnippet:
         :param kwargs: additonal args
         :return:
         """
-        ret = chat.invoke(
-            prompt.format_prompt(text=text, **kwargs), config={"callbacks": [langfuse_handler(["snippet", self.name])]}
-        )
-        finish_reason = None
-        for reason in ["finish_reason", "stop_reason", "done_reason"]:
-            try:
-                finish_reason = ret.response_metadata[reason]
-                break
-            except KeyError as e:
-                finish_reason = e
-                continue
-        else:
-            raise finish_reason
-
-        stop_str = ["stop", "end_turn", "stop_sequence"]
-        if finish_reason in stop_str:
-            # complete response received
-            return ret
-        else:
+        # the prompt is formatted once, the continuation only appends messages to the list
+        messages = prompt.format_messages(text=text, **kwargs)
+        # one handler for the request and all its continuations, it creates own langfuse client
+        config = {"callbacks": [langfuse_handler(["snippet", self.name])]}
+        start = time.monotonic()
+        ret = chat.invoke(messages, config=config)
+        responses = [ret]
+        while _finish_reason(ret) not in STOP_REASONS:
             # max tokens reached. Consider setting larger max_tokens
-            while finish_reason not in stop_str:
-                # ask for the next chunk
-                prompt.append(ret)  # add the previous chunk to the conversation
-                prompt.append(HumanMessage("The response is not complete, continue"))  # ask for more
-                ret = chat.invoke(
-                    prompt.format_prompt(text=text, **kwargs),
-                    config={"callbacks": [langfuse_handler(["snippet", self.name])]},
-                )  # send request to LLM
-                if ret.content.strip() == "":
-                    raise AttributeError(
-                        f"'max_tokens' {self.max_tokens} is too low to get response, consider increase it"
-                    )
-            # now wwe have all chunks. Concatenate all AI responses and return them together with last response from LLM
-            ret.content = "".join([ai_msg.content for ai_msg in prompt.messages if isinstance(ai_msg, AIMessage)])
-            return ret
+            # add the previous chunk to the conversation and ask for more
+            messages += [ret, HumanMessage("The response is not complete, continue")]
+            ret = chat.invoke(messages, config=config)
+            self._check_continuation(ret)
+            responses.append(ret)
+        self._set_usage(responses, time.monotonic() - start)
+        if len(responses) > 1:
+            # return all chunks together with last response from LLM
+            ret.content = "".join(r.content for r in responses)
+        return ret
+
+    async def ainvoke(
+        self, chat: Union[ChatOpenAI, AzureChatOpenAI], prompt: ChatPromptTemplate, text, **kwargs
+    ) -> BaseMessage:
+        """
+        Async version of `invoke()`.
+
+        :param chat: LLM Chat object
+        :param prompt: LLM prompt to use
+        :param text: query text
+        :param kwargs: additonal args
+        :return:
+        """
+        messages = prompt.format_messages(text=text, **kwargs)
+        config = {"callbacks": [langfuse_handler(["snippet", self.name])]}
+        start = time.monotonic()
+        ret = await chat.ainvoke(messages, config=config)
+        responses = [ret]
+        while _finish_reason(ret) not in STOP_REASONS:
+            messages += [ret, HumanMessage("The response is not complete, continue")]
+            ret = await chat.ainvoke(messages, config=config)
+            self._check_continuation(ret)
+            responses.append(ret)
+        self._set_usage(responses, time.monotonic() - start)
+        if len(responses) > 1:
+            ret.content = "".join(r.content for r in responses)
+        return ret
+
+    def _check_continuation(self, ret: BaseMessage):
+        """
+        Check the continuation response.
+
+        :param ret: LLM response
+        :return:
+        :raises AttributeError: If empty response received, max_tokens is too low
+        """
+        if ret.content.strip() == "":
+            raise AttributeError(f"'max_tokens' {self.max_tokens} is too low to get response, consider increase it")
+
+    def _set_usage(self, responses: List[BaseMessage], duration: float):
+        """
+        Store the token usage of the LLM request and all its continuations in `last_usage`.
+
+        :param responses: LLM responses of the request and its continuations
+        :param duration: Duration of the request in seconds
+        :return:
+        """
+        # not all providers report the usage
+        usage = [getattr(r, "usage_metadata", None) or {} for r in responses]
+        self.last_usage = dict(
+            tokens_in=sum(u.get("input_tokens", 0) for u in usage),
+            tokens_out=sum(u.get("output_tokens", 0) for u in usage),
+            duration_s=round(duration, 3),
+            model=self.model,
+        )
+        logger.info(f"{self.name}: usage={self.last_usage}")
+
+    def _llm_settings(self) -> Tuple[Dict, str]:
+        """
+        Get LLM settings and the role of system prompt.
+
+        If o1-* reasoning model is used, the system prompt becomes user prompt and temperature is always 1.
+        https://platform.openai.com/docs/guides/reasoning/quickstart
+
+        :return: Tuple of `chat_llm()` kwargs and system prompt role
+        """
+        llm_kwargs = dict(
+            force_api_type=self.force_api, model=self.model, json_mode=self.json_mode, cache_deterministic=True
+        )
+        if self.model.startswith("o1"):  # reasoning models
+            llm_kwargs.update(dict(max_completion_tokens=self.max_tokens, temperature=1))
+            return llm_kwargs, "human"
+        llm_kwargs.update(dict(temperature=self.temperature, max_tokens=self.max_tokens))
+        return llm_kwargs, "system"
+
+    def _semantic_cache(self, llm_kwargs: Dict, kwargs: Dict) -> Union[SemanticCache, None]:
+        """
+        Get the semantic cache for the snippet settings.
+
+        :param llm_kwargs: `chat_llm()` kwargs
+        :param kwargs: Additional key-value pairs to substitute in System prompt
+        :return: SemanticCache or None if not used
+        """
+        # the same system prompt is required, so the kwargs must not be used
+        if not self.cache_semantic or kwargs:
+            return None
+        # the settings used by `chat_llm()`, the Chat application can overwrite them
+        settings = OVERWRITE_LLM_SETTINGS.update_kwargs(dict(llm_kwargs))
+        if float(settings["temperature"]) == 0:
+            return None
+        api_type = get_llm_type(self.force_api).value
+        model = map_model(settings["model"], self.force_api)
+        max_tokens = settings.get("max_tokens", settings.get("max_completion_tokens"))
+        # the queries embedded by other model cannot be compared
+        embed_model = map_model("embed", self.force_api)
+        # edited prompt.md or contexts must not return responses of the old prompt
+        prompt_hash = hashlib.sha256(self.prompt.encode()).hexdigest()[:16]
+        try:
+            return semantic_cache(
+                f"{self.name}_{api_type}_{model}_{settings['temperature']}_{max_tokens}_{embed_model}_{prompt_hash}",
+                self.force_api,
+            )
+        except Exception as e:
+            # e.g. embedding model not available, the snippet works without the cache
+            logger.warning(f"{self.name}: semantic cache not used: {e}")
+            return None
+
+    @staticmethod
+    def _prompt_vars(prompt: ChatPromptTemplate, kwargs: Dict) -> Dict:
+        """
+        Get the variables to substitute in System prompt.
+
+        The current date is added only when the System prompt uses it, so it does not change the LLM cache key.
+
+        :param prompt: LLM prompt to use
+        :param kwargs: Additional key-value pairs to substitute in System prompt
+        :return: prompt variables without the query text
+        """
+        if "date" in prompt.input_variables:
+            return dict(date=datetime.now().strftime("%Y-%m-%d"), **kwargs)
+        return kwargs
+
+    def _output(self, content: str) -> str | Type[BaseModel]:
+        """
+        Serialize LLM response into Pydantic model if required.
+
+        :param content: LLM response
+        :return: LLM response or Pydantic model
+        """
+        return self.pydantic_output.model_validate_json(content) if self.pydantic_output else content
 
     def run(self, query: str, /, **kwargs) -> str | Type[BaseModel]:
         """
@@ -120,28 +285,136 @@ class BaseSnippet:
         This function processes the query using a language model,
         applying different settings based on the model type.
 
-        If o1-* reasoning model is used, the system prompt becomes user prompt and temperature is always 1.
-        https://platform.openai.com/docs/guides/reasoning/quickstart
+        With temperature 0, responses are cached on disk, so the same query is not sent to LLM again.
+        Otherwise, if `cache_semantic` is set, the response of similar query is returned from semantic cache.
+
+        :param query: Text passed as Human text to LLM chat.
+        :param kwargs: Additional key-value pairs to substitute in System prompt.
+        :return: The content of the language model's response, empty string for empty query.
+        """
+        if not query.strip():
+            # nothing to ask about, do not waste the LLM round-trip
+            return ""
+        logger.info(f"{self.name}: query={query[0:80]}..., {kwargs=}")
+        llm_kwargs, system_role = self._llm_settings()
+        cache = self._semantic_cache(llm_kwargs, kwargs)
+        if cache:
+            content, vector = cache.lookup(query, self.semantic_threshold)
+            if content is not None:
+                logger.info(f"{self.name}: ret(cached)={content[0:80]}")
+                return self._output(content)
+        chat = chat_llm(**llm_kwargs)
+        prompt = _snippet_template(system_role, self.prompt)
+        ret = self.invoke(chat, prompt, text=query, **self._prompt_vars(prompt, kwargs))
+        logger.info(f"{self.name}: ret={ret.content[0:80]}")
+        if cache:
+            cache.update(query, vector, ret.content)
+        return self._output(ret.content)
+
+    async def arun(self, query: str, /, **kwargs) -> str | Type[BaseModel]:
+        """
+        Async version of `run()`.
+
+        Independent snippet calls can be run together:
+        `await asyncio.gather(*[snippet.arun(query) for query in queries])`
+
+        Specialised snippet which overwrites `run()` only, is run in a thread to not block the event loop.
 
         :param query: Text passed as Human text to LLM chat.
         :param kwargs: Additional key-value pairs to substitute in System prompt.
         :return: The content of the language model's response.
         """
+        if type(self).run is not BaseSnippet.run and type(self).arun is BaseSnippet.arun:
+            return await asyncio.to_thread(self.run, query, **kwargs)
+        if not query.strip():
+            # nothing to ask about, do not waste the LLM round-trip
+            return ""
         logger.info(f"{self.name}: query={query[0:80]}..., {kwargs=}")
-        llm_kwargs = dict(force_api_type=self.force_api, model=self.model, json_mode=self.json_mode)
-        if self.model.startswith("o1"):  # reasoning models
-            llm_kwargs.update(dict(max_completion_tokens=self.max_tokens, temperature=1))
-            system_role = "human"
-        else:
-            llm_kwargs.update(dict(temperature=self.temperature, max_tokens=self.max_tokens))
-            system_role = "system"
+        llm_kwargs, system_role = self._llm_settings()
+        cache = self._semantic_cache(llm_kwargs, kwargs)
+        if cache:
+            content, vector = await asyncio.to_thread(cache.lookup, query, self.semantic_threshold)
+            if content is not None:
+                logger.info(f"{self.name}: ret(cached)={content[0:80]}")
+                return self._output(content)
         chat = chat_llm(**llm_kwargs)
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (system_role, self.prompt),
-                ("human", "{text}"),
-            ]
-        )
-        ret = self.invoke(chat, prompt, text=query, date=datetime.now().strftime("%Y-%m-%d"), **kwargs)
-        logger.info(f"{self.name}: ret={str(ret)[0:80]}")
-        return self.pydantic_output.model_validate_json(ret.content) if self.pydantic_output else ret.content
+        prompt = _snippet_template(system_role, self.prompt)
+        ret = await self.ainvoke(chat, prompt, text=query, **self._prompt_vars(prompt, kwargs))
+        logger.info(f"{self.name}: ret={ret.content[0:80]}")
+        if cache:
+            await asyncio.to_thread(cache.update, query, vector, ret.content)
+        return self._output(ret.content)
+
+    def run_batch(self, queries: List[str], /, **kwargs) -> List[str | Type[BaseModel]]:
+        """
+        Run the snippet with many independent user queries.
+
+        The queries are sent concurrently as separate requests, so each response is the same as from `run()`.
+
+        :param queries: Texts passed as Human text to LLM chat.
+        :param kwargs: Additional key-value pairs to substitute in System prompt.
+        :return: The responses in the order of queries.
+        """
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers=min(8, len(queries)), thread_name_prefix=self.name) as pool:
+            return list(pool.map(lambda query: self.run(query, **kwargs), queries))
+
+    async def arun_batch(self, queries: List[str], /, **kwargs) -> List[str | Type[BaseModel]]:
+        """
+        Async version of `run_batch()`.
+
+        :param queries: Texts passed as Human text to LLM chat.
+        :param kwargs: Additional key-value pairs to substitute in System prompt.
+        :return: The responses in the order of queries.
+        """
+        return list(await asyncio.gather(*[self.arun(query, **kwargs) for query in queries]))
+
+    def stream(self, query: str, /, **kwargs) -> Iterator[str]:
+        """
+        Run the snippet with a user query and yield the response chunks as they arrive.
+
+        The chunks are not cached, and the generation is not continued when max_tokens has been reached.
+        Specialised snippet which overwrites `run()` yields its complete response at once.
+
+        :param query: Text passed as Human text to LLM chat.
+        :param kwargs: Additional key-value pairs to substitute in System prompt.
+        :return: Iterator of response chunks, join them to get complete response
+        """
+        if type(self).run is not BaseSnippet.run:
+            yield self.run(query, **kwargs)
+            return
+        if not query.strip():
+            return
+        logger.info(f"{self.name}: stream query={query[0:80]}..., {kwargs=}")
+        llm_kwargs, system_role = self._llm_settings()
+        chat = chat_llm(**llm_kwargs)
+        prompt = _snippet_template(system_role, self.prompt)
+        for chunk in chat.stream(
+            prompt.format_prompt(text=query, **self._prompt_vars(prompt, kwargs)),
+            config={"callbacks": [langfuse_handler(["snippet", self.name])]},
+        ):
+            yield chunk.content
+
+    async def astream(self, query: str, /, **kwargs) -> AsyncIterator[str]:
+        """
+        Async version of `stream()`.
+
+        :param query: Text passed as Human text to LLM chat.
+        :param kwargs: Additional key-value pairs to substitute in System prompt.
+        :return: Async iterator of response chunks, join them to get complete response
+        """
+        if type(self).run is not BaseSnippet.run:
+            yield await self.arun(query, **kwargs)
+            return
+        if not query.strip():
+            return
+        logger.info(f"{self.name}: stream query={query[0:80]}..., {kwargs=}")
+        llm_kwargs, system_role = self._llm_settings()
+        chat = chat_llm(**llm_kwargs)
+        prompt = _snippet_template(system_role, self.prompt)
+        async for chunk in chat.astream(
+            prompt.format_prompt(text=query, **self._prompt_vars(prompt, kwargs)),
+            config={"callbacks": [langfuse_handler(["snippet", self.name])]},
+        ):
+            yield chunk.content
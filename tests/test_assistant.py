@@ -0,0 +1,58 @@
+"""Tests of assistants.assistant."""
+
+import pytest
+from langchain_core.messages import AIMessage
+
+import assistants.assistant
+from assistants.assistant import BaseAssistant
+
+
+class FakeEncoding:
+    """Encoding with one token per word, no need to download the tiktoken files."""
+
+    def encode(self, text):
+        return text.split()
+
+
+class FakeChat:
+    """Chat which always returns the same response."""
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def invoke(self, messages, config=None):
+        return AIMessage(content=self.content)
+
+
+@pytest.fixture
+def assistant(monkeypatch, tmp_path):
+    monkeypatch.setenv("KRAINA_DB", str(tmp_path / "kraina.db"))
+    monkeypatch.setattr(assistants.assistant, "_get_encoding", lambda model: FakeEncoding())
+    monkeypatch.setattr(BaseAssistant, "_chat_llm", lambda self: FakeChat("Hi, how can I help you?"))
+    assistants.assistant._encoded_len.cache_clear()
+    yield BaseAssistant(name="test", prompt="You are a helpful assistant.")
+    assistants.assistant._encoded_len.cache_clear()
+
+
+def test_tokens_new_conversation_history_includes_query(assistant):
+    resp = assistant.run("Hello there")
+    # "Hello there" (2) + ADDITIONAL_TOKENS_PER_MSG
+    assert resp.tokens["history"] == 5
+    assert resp.tokens["input"] == 5
+    # "You are a helpful assistant." (5) + ADDITIONAL_TOKENS_PER_MSG
+    assert resp.tokens["prompt"] == 8
+    assert resp.tokens["total_input"] == 18
+
+
+def test_tokens_existing_conversation_history(assistant):
+    conv_id = assistant.run("Hello there").conv_id
+    resp = assistant.run("What is 2+2?", conv_id=conv_id)
+    # "Hello there" (2) + "Hi, how can I help you?" (6) + 2 * ADDITIONAL_TOKENS_PER_MSG
+    assert resp.tokens["history"] == 14
+    assert resp.conv_id == conv_id
+
+
+def test_tokens_without_db(assistant):
+    resp = assistant.run("Hello there", use_db=False)
+    assert resp.conv_id is None
+    assert resp.tokens["history"] == 0
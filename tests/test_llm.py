@@ -0,0 +1,35 @@
+"""Tests of libs.llm."""
+
+import pickle
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import libs.llm
+from libs.llm import SemanticCache
+
+
+def test_semantic_cache_corrupted_dump_starts_empty(monkeypatch, tmp_path):
+    monkeypatch.setattr(libs.llm, "SEMANTIC_CACHE_PATH", tmp_path)
+    (tmp_path / "test.pkl").write_bytes(b"not a pickle")
+    cache = SemanticCache("test", DeterministicFakeEmbedding(size=8))
+    assert cache.lookup("question", 0.9)[0] is None
+
+
+def test_semantic_cache_dump_error_is_not_raised(monkeypatch, tmp_path):
+    monkeypatch.setattr(libs.llm, "SEMANTIC_CACHE_PATH", tmp_path / "file")
+    (tmp_path / "file").write_text("a file in place of the cache folder")
+    cache = SemanticCache("test", DeterministicFakeEmbedding(size=8))
+    _, vector = cache.lookup("question", 0.9)
+    cache.update("question", vector, "response")
+    cache.dump()
+    assert cache.lookup("question", 0.9)[0] == "response"
+
+
+def test_semantic_cache_dump_and_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(libs.llm, "SEMANTIC_CACHE_PATH", tmp_path)
+    cache = SemanticCache("test", DeterministicFakeEmbedding(size=8))
+    _, vector = cache.lookup("question", 0.9)
+    cache.update("question", vector, "response")
+    cache.dump()
+    assert len(pickle.loads((tmp_path / "test.pkl").read_bytes())) == 1
+    assert SemanticCache("test", DeterministicFakeEmbedding(size=8)).lookup("question", 0.9)[0] == "response"
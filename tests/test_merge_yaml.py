@@ -0,0 +1,84 @@
+"""Tests of setup_scripts.merge_yaml."""
+
+import pytest
+import yaml
+
+from setup_scripts.merge_yaml import merge_yaml_files
+
+
+@pytest.fixture
+def files(tmp_path):
+    def _files(primary: str, secondary: str):
+        primary_file = tmp_path / "primary.yaml"
+        secondary_file = tmp_path / "secondary.yaml"
+        primary_file.write_text(primary)
+        secondary_file.write_text(secondary)
+        return str(primary_file), str(secondary_file)
+
+    return _files
+
+
+def test_merge_adds_new_keys_only(files):
+    primary, secondary = files("a: 1\nb:\n  c: 2\n", "a: 10\nb:\n  c: 20\n  d: 30\ne: 40\n")
+    expected = {"a": 1, "b": {"c": 2, "d": 30}, "e": 40}
+    assert merge_yaml_files(primary, secondary) == expected
+    with open(primary) as f:
+        assert yaml.safe_load(f) == expected
+
+
+def test_merge_overwrite_nested_path(files):
+    primary, secondary = files(
+        "server:\n  host: old\n  port: 1\n  db:\n    user: old\n    password: old\n",
+        "server:\n  host: new\n  port: 2\n  db:\n    user: new\n    password: new\n    name: kraina\n",
+    )
+    assert merge_yaml_files(primary, secondary, {"server.host", "server.db.password"}) == {
+        "server": {"host": "new", "port": 1, "db": {"user": "old", "password": "new", "name": "kraina"}}
+    }
+
+
+def test_merge_overwrite_key_deep_merges_dict(files):
+    primary, secondary = files("llm:\n  map:\n    A: a\n", "llm:\n  map:\n    A: aa\n    B: b\n")
+    # the overwritable dicts are merged, not replaced
+    assert merge_yaml_files(primary, secondary, {"llm.map"}) == {"llm": {"map": {"A": "a", "B": "b"}}}
+
+
+def test_merge_overwrite_siblings_deep_merged(files):
+    primary, secondary = files(
+        "llm:\n  map:\n    A: a\n  other:\n    x: 1\n", "llm:\n  map:\n    A: aa\n  other:\n    x: 2\n    y: 3\n"
+    )
+    assert merge_yaml_files(primary, secondary, {"llm.map.A"}) == {
+        "llm": {"map": {"A": "aa"}, "other": {"x": 1, "y": 3}}
+    }
+
+
+def test_merge_int_keys(files):
+    primary, secondary = files("ports:\n  1: a\n  2: b\n", "ports:\n  1: aa\n  2: bb\n  3: cc\n")
+    assert merge_yaml_files(primary, secondary, {"ports.1"}) == {"ports": {1: "aa", 2: "b", 3: "cc"}}
+
+
+def test_merge_empty_files(files):
+    primary, secondary = files("", "a: 1\n")
+    assert merge_yaml_files(primary, secondary) == {"a": 1}
+    primary, secondary = files("a: 1\n", "")
+    assert merge_yaml_files(primary, secondary) == {"a": 1}
+
+
+def test_merge_keeps_primary_file_when_dump_fails(files, monkeypatch, tmp_path):
+    primary, secondary = files("a: 1\nb: 2\n", "c: 3\n")
+
+    def _failing_dump(data, stream, **kwargs):
+        stream.write("a: 1\n")
+        raise yaml.YAMLError("dump failed")
+
+    monkeypatch.setattr(yaml, "dump", _failing_dump)
+    with pytest.raises(yaml.YAMLError):
+        merge_yaml_files(primary, secondary)
+    with open(primary) as f:
+        assert f.read() == "a: 1\nb: 2\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["primary.yaml", "secondary.yaml"]
+
+
+def test_merge_missing_file(files, tmp_path):
+    primary, _ = files("a: 1\n", "")
+    with pytest.raises(FileNotFoundError):
+        merge_yaml_files(primary, str(tmp_path / "missing.yaml"))
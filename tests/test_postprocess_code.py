@@ -0,0 +1,48 @@
+"""Tests of snippets.code.PostprocessCode."""
+
+import pytest
+
+from snippets.code.PostprocessCode import PostprocessCode
+
+
+@pytest.fixture
+def snippet():
+    return PostprocessCode(name="code", prompt="Write the code")
+
+
+@pytest.mark.parametrize(
+    "ret",
+    [
+        "```\nx = 1\ny = 2\n```",
+        "```\nx = 1\ny = 2\n```\n",
+        "```python\nx = 1\ny = 2\n```",
+        "x = 1\ny = 2",
+        "x = 1\ny = 2\n",
+        "```python\r\nx = 1\r\ny = 2\r\n```\r\n",
+        "x = 1\r\ny = 2\r\n",
+    ],
+)
+def test_postprocess_strips_fences(snippet, ret):
+    assert snippet._postprocess(ret, 0) == "x = 1\ny = 2"
+
+
+@pytest.mark.parametrize(
+    "ret, expected",
+    [
+        ("```python\ndef f():\n    return 1\n```", "    def f():\n        return 1"),
+        ("```python\r\ndef f():\r\n\r\n    return 1\r\n```", "    def f():\n    \n        return 1"),
+        ("def f():\n    return 1\n", "    def f():\n        return 1"),
+    ],
+)
+def test_postprocess_indents_code(snippet, ret, expected):
+    assert snippet._postprocess(ret, 4) == expected
+
+
+@pytest.mark.parametrize("ret", ["", "```", "```python\n```", "```\r\n```\r\n"])
+def test_postprocess_empty_code(snippet, ret):
+    assert snippet._postprocess(ret, 4) == ""
+
+
+def test_postprocess_keeps_fences_inside_code(snippet):
+    ret = "```markdown\n# Title\n```python\nx = 1\n```\n```"
+    assert snippet._postprocess(ret, 0) == "# Title\n```python\nx = 1\n```"
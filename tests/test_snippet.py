@@ -0,0 +1,68 @@
+"""Tests of snippets.snippet."""
+
+import asyncio
+
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+import libs.llm
+import snippets.snippet
+from libs.llm import SemanticCache
+from snippets.snippet import BaseSnippet
+
+
+class FakeChat:
+    """Chat which always returns complete response."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.calls = 0
+
+    def invoke(self, messages, config=None):
+        self.calls += 1
+        return AIMessage(content=self.content, response_metadata={"finish_reason": "stop"})
+
+    async def ainvoke(self, messages, config=None):
+        return self.invoke(messages, config)
+
+
+class FailingEmbeddings(Embeddings):
+    """Embeddings which cannot reach the API."""
+
+    def embed_documents(self, texts):
+        raise ConnectionError("embedding API not available")
+
+    def embed_query(self, text):
+        raise ConnectionError("embedding API not available")
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    chat = FakeChat("LLM response")
+    monkeypatch.setattr(snippets.snippet, "chat_llm", lambda **kwargs: chat)
+    return chat
+
+
+@pytest.fixture
+def snippet():
+    return BaseSnippet(name="test", prompt="You are helpful", temperature=0.5, cache_semantic=True)
+
+
+def test_run_with_failing_embedder_returns_llm_response(monkeypatch, tmp_path, chat, snippet):
+    monkeypatch.setattr(libs.llm, "SEMANTIC_CACHE_PATH", tmp_path)
+    monkeypatch.setattr(
+        snippets.snippet, "semantic_cache", lambda name, force: SemanticCache(name, FailingEmbeddings())
+    )
+    assert snippet.run("question") == "LLM response"
+    assert asyncio.run(snippet.arun("question")) == "LLM response"
+    assert chat.calls == 2
+
+
+def test_run_when_semantic_cache_cannot_be_created_returns_llm_response(monkeypatch, chat, snippet):
+    def no_cache(name, force):
+        raise ValueError("no embedding model")
+
+    monkeypatch.setattr(snippets.snippet, "semantic_cache", no_cache)
+    assert snippet.run("question") == "LLM response"
+    assert chat.calls == 1
@@ -0,0 +1,222 @@
+"""Tests of libs.utils."""
+
+import os
+import re
+from pathlib import Path
+
+import pytest
+
+import libs.utils
+from libs.utils import MARKDOWN, get_func_args, kraina_db, replace_code_blocks, restore_text, str_shortening, to_md
+
+
+@pytest.mark.parametrize("text", ["__init__", "snake_case_name", "_private and __dunder__ names"])
+def test_markdown_underscore_is_plain_text(text):
+    # markdown2 code-friendly behaviour, underscores do not start emphasis
+    assert MARKDOWN.render(text) == f"<p>{text}</p>\n"
+
+
+def test_markdown_asterisk_emphasis():
+    assert MARKDOWN.render("**bold** and *italic*") == "<p><strong>bold</strong> and <em>italic</em></p>\n"
+
+
+@pytest.fixture
+def no_to_md_cache():
+    to_md.cache_clear()
+    yield
+    to_md.cache_clear()
+
+
+def test_to_md_fence_with_language_highlighted(no_to_md_cache):
+    html = to_md("```python\nx = 1\n```")
+    assert html.startswith('<div class="codehilite"><pre>')
+    assert '<span class="n">x</span>' in html
+    assert '<span class="mi">1</span>' in html
+
+
+@pytest.mark.parametrize("text", ["```\nx = 1\n```", "```unknown-language\nx = 1\n```"])
+def test_to_md_fence_without_lexer(no_to_md_cache, text):
+    assert "<pre><code" in to_md(text)
+    assert "x = 1" in to_md(text)
+
+
+def test_to_md_table(no_to_md_cache):
+    html = to_md("| a | b |\n|---|---|\n| 1 | 2 |")
+    assert "<table>" in html
+    assert "<th>a</th>" in html
+    assert "<td>2</td>" in html
+
+
+def test_to_md_raw_html(no_to_md_cache):
+    assert to_md('<img src="x.png"/>') == '<img src="x.png"/>'
+    assert to_md("a <b>bold</b> text") == "<p>a <b>bold</b> text</p>\n"
+
+
+class _FakeChatImages:
+    """Chat images store, which has all images already rendered."""
+
+    def get(self, name):
+        return "image"
+
+    def get_file_url(self, name, inverted=False):
+        return f"file:///{name}.png"
+
+
+def test_to_md_mermaid_and_latex_placeholders(no_to_md_cache, monkeypatch):
+    monkeypatch.setattr(libs.utils.chat_images, "chat_images", _FakeChatImages())
+    monkeypatch.setattr(libs.utils, "image_size", lambda name, mode: (10, 20))
+    graph = "graph TD\nA-->B\n"
+    html = to_md(f"Graph:\n\n```mermaid\n{graph}```\n\nFormula \\(x^2\\) and `\\(code\\)`", "black")
+    mermaid_name = libs.utils.content_key(graph)
+    latex_name = libs.utils.content_key("x^2")
+    assert f'<img src="file:///{mermaid_name}.png" alt="{mermaid_name}" width="10" height="20"/>' in html
+    assert f'<img src="file:///{latex_name}.png" alt="{latex_name}"/>' in html
+    # latex in code is not rendered
+    assert "<code>\\(code\\)</code>" in html
+    assert "\xd7" not in html
+
+
+@pytest.mark.parametrize("text", ["Hello world", 'Say "hi" now', "Question? Yes.", ""])
+def test_to_md_plain_text_fast_path(no_to_md_cache, text):
+    assert not libs.utils.MARKDOWN_MARKERS_RE.search(text)
+    assert to_md(text) == MARKDOWN.render(text)
+    assert to_md(text, "red") == f'<span style="color:red">{MARKDOWN.render(text)}</span>'
+
+
+@pytest.mark.parametrize("text", ["# Title", "1. item", " indented", "a_b_", "a & b", "x\ny", "- item"])
+def test_to_md_markdown_markers_rendered(no_to_md_cache, text):
+    assert libs.utils.MARKDOWN_MARKERS_RE.search(text)
+    assert to_md(text) == MARKDOWN.render(text)
+
+
+def _regex_replace_code_blocks(text):
+    """The regex implementation replaced by replace_code_blocks, the reference of its behaviour."""
+    code_map = {}
+    for pattern in [re.compile(r"```[\s\S]*?```"), re.compile(r"`[^`]+`")]:
+
+        def _replace(m):
+            placeholder = f"__\xd7_{len(code_map)}__"
+            code_map[placeholder] = m.group(0)
+            return placeholder
+
+        text = pattern.sub(_replace, text)
+    return text, code_map
+
+
+CODE_BLOCKS_TEXTS = [
+    "no code at all",
+    "",
+    "call `func()` and `other()`",
+    "```python\nprint('x')\n```",
+    "before\n```\na = 1\n```\nafter `x`",
+    "```\nunclosed fence",
+    "text ``` and ` alone",
+    "```a```\n```b```",
+    "``````",
+    "```outer\n```inner```\n```",
+    "````\nfour backticks\n````",
+    "empty `` inline and `code`",
+    "``a`",
+    "```md\nuse `x` here\n``` and `y`",
+]
+
+
+@pytest.mark.parametrize("text", CODE_BLOCKS_TEXTS)
+def test_replace_code_blocks_as_regex(text):
+    assert replace_code_blocks(text) == _regex_replace_code_blocks(text)
+
+
+@pytest.mark.parametrize("text", CODE_BLOCKS_TEXTS)
+def test_restore_text_round_trip(text):
+    assert restore_text(*replace_code_blocks(text)) == text
+
+
+def test_replace_code_blocks_fence_with_language():
+    text, code_map = replace_code_blocks("see:\n```python\nx = `y`\n```\nand `z`")
+    assert text == "see:\n__\xd7_0__\nand __\xd7_1__"
+    assert code_map == {"__\xd7_0__": "```python\nx = `y`\n```", "__\xd7_1__": "`z`"}
+
+
+def test_replace_code_blocks_unclosed_fence_is_text():
+    assert replace_code_blocks("```python\nx = 1") == ("```python\nx = 1", {})
+
+
+def test_restore_text_many_placeholders():
+    # __\xd7_1__ must not be restored inside of __\xd7_10__
+    text, code_map = replace_code_blocks(" ".join(f"`c{i}`" for i in range(12)))
+    assert "__\xd7_10__" in text
+    assert restore_text(text, code_map) == " ".join(f"`c{i}`" for i in range(12))
+
+
+def test_restore_text_without_placeholders():
+    assert restore_text("plain text", {"__\xd7_0__": "`x`"}) == "plain text"
+    assert restore_text("__\xd7_0__", {}) == "__\xd7_0__"
+
+
+@pytest.mark.parametrize("data", ["x" * 9, "x" * 10, {"k": "v"}, ["a", "b"], [1, 2], b"x" * 7])
+def test_str_shortening_at_or_below_limit(data):
+    assert len(str(data)) <= 10
+    assert str_shortening(data, 10) == str(data)
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        ("0123456789A", "01234... (1 truncated) ...6789A"),
+        ("x" * 1000, "xxxxx... (990 truncated) ...xxxxx"),
+        # str() of the dict is truncated
+        ({"key": "value"}, "{'key... (6 truncated) ...lue'}"),
+        (["a", "b", "c"], "['a',... (5 truncated) ... 'c']"),
+        (b"0123456789", "b'012... (3 truncated) ...6789'"),
+    ],
+)
+def test_str_shortening_above_limit(data, expected):
+    assert str_shortening(data, 10) == expected
+
+
+def test_str_shortening_odd_limit():
+    assert str_shortening("0123456789", 9) == "0123... (2 truncated) ...6789"
+
+
+def test_str_shortening_escapes_kept_text():
+    assert str_shortening("a\nimg-b", 10) == "a\\nIMG-b"
+    # the limit applies to the raw text, only the kept head and tail are escaped
+    assert str_shortening("\n\n\n\n\nmiddle\n\n\n\n\n", 10) == "\\n\\n\\n\\n\\n... (6 truncated) ...\\n\\n\\n\\n\\n"
+    assert str_shortening({"img-x": "y" * 20}, 14) == "{'IMG-x... (19 truncated) ...yyyyy'}"
+
+
+def test_kraina_db_follows_env_changes(monkeypatch, tmp_path):
+    monkeypatch.setenv("KRAINA_DB", str(tmp_path / "first.db"))
+    assert kraina_db() == str(tmp_path / "first.db")
+    monkeypatch.setenv("KRAINA_DB", str(tmp_path / "second.db"))
+    assert kraina_db() == str(tmp_path / "second.db")
+
+
+def test_kraina_db_set_new_db(monkeypatch):
+    monkeypatch.delenv("KRAINA_DB", raising=False)
+    expected = str((Path(__file__).parent.parent / "other.db").resolve())
+    assert kraina_db("other.db") == expected
+    assert os.environ["KRAINA_DB"] == expected
+
+
+class _Macro:
+    def run(self, name: str, count: int = 2):
+        pass
+
+
+def test_get_func_args_bound_method_cached():
+    method = _Macro().run
+    expected = {"name(str)": None, "count(int)": "2"}
+    assert get_func_args(method) == expected
+    assert _Macro.run._kraina_bound_args == tuple(expected.items())
+    # another instance reuses the signature stored on the function
+    assert get_func_args(_Macro().run) == expected
+    # each caller gets its own dictionary
+    get_func_args(method)["name(str)"] = "changed"
+    assert get_func_args(method) == expected
+
+
+def test_get_func_args_function_and_bound_method_differ():
+    assert get_func_args(_Macro.run) == {"self(Any)": None, "name(str)": None, "count(int)": "2"}
+    assert get_func_args(_Macro().run) == {"name(str)": None, "count(int)": "2"}
+    assert get_func_args(_Macro.run) == {"self(Any)": None, "name(str)": None, "count(int)": "2"}
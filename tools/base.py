@@ -6,7 +6,7 @@ from typing import List
 import yaml
 from langchain_core.tools import BaseTool
 
-from libs.utils import import_module, find_lands
+from libs.utils import import_module, find_lands, SafeLoader
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +31,7 @@ def get_and_init_tools(tools: List[str], assistant=None) -> List[BaseTool]:
     # TODO: What will happen when snippets instead of assistants will use tools
     if (Path(__file__).parent / "../config.yaml").resolve().exists():
         with open((Path(__file__).parent / "../config.yaml").resolve(), "r") as f:
-            data = yaml.load(f, Loader=yaml.SafeLoader)
+            data = yaml.load(f, Loader=SafeLoader)
     else:
         logger.warning(
             f"{(Path(__file__).parent / '../config.yaml').resolve()} does not exist. No tools settings available"